@@ -0,0 +1,2397 @@
+import errno
+import functools
+import itertools
+import json
+import logging
+import operator
+import os
+import queue
+import random
+import struct
+import threading
+import time
+import usb.core
+import usb.util
+from array import array
+from collections import Counter, defaultdict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from enum import Enum, IntEnum, unique
+from types import SimpleNamespace
+
+logger = logging.getLogger(__name__)
+
+#
+#USB code
+#
+
+@unique
+class State(IntEnum):
+  ENABLED = 1
+  DISABLED = 0
+
+@unique
+class InputType(Enum):
+  # Apogee Duet uses this value for each input type, that's why I choose these values 
+  LINE_4DBU = 0
+  LINE_10DBV = 1
+  MICROPHONE = 2
+  INSTRUMENT = 3
+  
+  def __str__(self):
+    string_representations = {
+      self.LINE_4DBU: '+4dBu',
+      self.LINE_10DBV: '-10dBV',
+      self.MICROPHONE: 'Microphone',
+      self.INSTRUMENT: 'Instrument'
+    }
+    return string_representations[self]
+    
+  @classmethod
+  def str_list(cls):
+    return [str(t) for t in list(cls)]
+
+# An attribute with the value of a register, the state is kept by ApogeeDuet 
+# so the changes made on the device itself are seen too
+def _register_property(name):
+  getter_name = 'get_' + name
+  setter_name = 'set_' + name
+  def getter(self):
+    return getattr(self._device, getter_name)(self)
+  def setter(self, value):
+    getattr(self._device, setter_name)(self, value)
+  return property(getter, setter)
+
+class Input(object):
+  _level_range = {
+    InputType.MICROPHONE: { 
+      'max': 75,
+      'min': 0
+    },
+    InputType.INSTRUMENT: {
+      'max': 65,
+      'min': 0
+    }
+  }
+  
+  # The register behind each attribute, see _REGISTERS
+  _registers = {
+    'type_': 'input_type',
+    'level': 'input_level',
+    'phantom_power_state': 'phantom_power_state',
+    'phase_state': 'phase_state',
+    'softlimit_state': 'softlimit_state',
+    'group_state': 'group_state',
+  }
+  # The attribute of each parameter, see ApogeeDuet.parameters()
+  _parameters = {
+    'type': 'type_',
+    'level': 'level',
+    'phantom_power': 'phantom_power_state',
+    'phase': 'phase_state',
+    'softlimit': 'softlimit_state',
+    'group': 'group_state',
+  }
+  phantom_power_state = _register_property('phantom_power_state')
+  phase_state = _register_property('phase_state')
+  softlimit_state = _register_property('softlimit_state')
+  
+  # There's one of these per input, output and channel and they only point to the device, the values are in its register file
+  __slots__ = ('_device', 'index', 'number')
+
+  def __init__(self, device, index):
+    self._device = device
+    self.index = index
+    self.number = index + 1
+    
+  @property
+  def min_level(self):
+    return self._level_limits()['min']
+  
+  @property
+  def max_level(self):
+    return self._level_limits()['max']
+
+  # The line inputs have no level, like the level itself it's a ValueError
+  def _level_limits(self):
+    type_ = self.type_
+    if type_ not in self._level_range:
+      raise ValueError('input_level is not available for {}'.format(type_))
+    return self._level_range[type_]
+    
+  @property
+  def group_state(self):
+    return self._device.get_group_state(self)
+
+  @group_state.setter
+  def group_state(self, value):
+    self._device.set_group_state(State(value))
+
+  @property
+  def type_(self):
+    return self._device.get_input_type(self)
+    
+  @type_.setter
+  def type_(self, value):
+    self._device.set_input_type(self, InputType(value))
+
+  @property
+  def level(self):
+    return self._device.get_input_level(self)
+
+  @level.setter
+  def level(self, value):
+    self._device.queue_input_level(self, value)
+    
+  def toggle_phantom_power(self):
+    self._device.set_phantom_power_state(self, State(not self.phantom_power_state))
+    
+  def toggle_phase(self):
+    self._device.set_phase_state(self, State(not self.phase_state))
+    
+  def toggle_softlimit(self):
+    self._device.set_softlimit_state(self, State(not self.softlimit_state))
+
+  def toggle_group(self):
+    self._device.set_group_state(State(not self.group_state))
+
+@unique 
+class OutputSource(Enum):
+  PLAYBACK_1_2 = 0
+  PLAYBACK_3_4 = 1
+  MIXER = 2
+
+  def __str__(self):
+    string_representations = {
+      self.PLAYBACK_1_2: '1-2',
+      self.PLAYBACK_3_4: '3-4',
+      self.MIXER: 'Mixer'
+    }
+    return string_representations[self]
+
+  @classmethod
+  def str_list(cls):
+    return [str(t) for t in list(cls)]
+
+@unique
+class SpeakerOutputType(Enum):
+  # Apogee Duet uses this value for each input type, that's why I choose these values
+  LINE_4DBU = 0
+  LINE_10DBV = 1
+
+  def __str__(self):
+    string_representations = {
+      self.LINE_4DBU: '+4dBu',
+      self.LINE_10DBV: '-10dBV'
+    }
+    return string_representations[self]
+
+  @classmethod
+  def str_list(cls):
+    return [str(t) for t in list(cls)]
+
+@unique
+class OutputType(Enum):
+  # Apogee Duet uses this value for each input type, that's why I choose these values
+  SPEAKERS = 0
+  HEADPHONES = 1
+
+  def __str__(self):
+    string_representations = {
+      self.SPEAKERS: 'Speakers',
+      self.HEADPHONES: 'Headphones'
+    }
+    return string_representations[self]
+
+class Output(object):
+  _level_range = {
+    'min': -64,
+    'max': 0
+  }
+  min_level = _level_range['min']
+  max_level = _level_range['max']
+  _registers = {
+    'level': 'output_level',
+    'mute_state': 'mute_state',
+    'dim_state': 'dim_state',
+    'mono_state': 'mono_state',
+    'source': 'output_source',
+    'spekaer_output_type': 'speaker_output_type',
+  }
+  _all_parameters = {
+    'level': 'level',
+    'mute': 'mute_state',
+    'dim': 'dim_state',
+    'mono': 'mono_state',
+    'source': 'source',
+    'speaker_output_type': 'spekaer_output_type',
+  }
+  mute_state = _register_property('mute_state')
+  dim_state = _register_property('dim_state')
+  mono_state = _register_property('mono_state')
+  
+  __slots__ = ('_device', 'index', 'type_', '_parameters')
+
+  def __init__(self, device, index, type_):
+    self._device = device
+    self.index = index
+    self.type_ = type_
+    self._parameters = self._all_parameters
+    if self.type_ != OutputType.SPEAKERS:
+      # Only the speakers have an output type
+      self._parameters = {name: attribute for name, attribute in self._all_parameters.items() if attribute != 'spekaer_output_type'}
+
+  def toggle_mute(self):
+    self._device.set_mute_state(self, State(not self.mute_state))
+
+  def toggle_dim(self):
+    self._device.set_dim_state(self, State(not self.dim_state))
+
+  def toggle_mono(self):
+    self._device.set_mono_state(self, State(not self.mono_state))
+
+  @property
+  def level(self):
+    return self._device.get_output_level(self)
+
+  @level.setter
+  def level(self, value):
+    self._device.cancel_ramp(self, 'level')
+    self._device.queue_output_level(self, value)
+
+  # Fades the level to the given one in duration seconds, returns the Ramp
+  def fade_to(self, level, duration):
+    return self._device.ramp(self, 'level', level, duration)
+
+  @property
+  def spekaer_output_type(self):
+    return self._device.get_speaker_output_type(self)
+    
+  @spekaer_output_type.setter
+  def spekaer_output_type(self, value):
+    self._device.set_speaker_output_type(self, SpeakerOutputType(value))
+
+  @property
+  def source(self):
+    return self._device.get_output_source(self)
+    
+  @source.setter
+  def source(self, value):
+    self._device.set_output_source(self, OutputSource(value))
+
+
+@unique 
+class SoftwareReturnSource(Enum):
+  PLAYBACK_1_2 = 0
+  PLAYBACK_3_4 = 1
+
+  def __str__(self):
+    string_representations = {
+      self.PLAYBACK_1_2: '1-2',
+      self.PLAYBACK_3_4: '3-4',
+    }
+    return string_representations[self]
+
+  @classmethod
+  def str_list(cls):
+    return [str(t) for t in list(cls)]
+
+@unique
+class ChannelType(Enum):
+  INPUT = 0
+  SOFTWARE_RETURN = 1
+  MASTER = 2
+  
+  def __str__(self):
+    string_representations = {
+      self.INPUT: 'Input',
+      self.SOFTWARE_RETURN: 'Software Return',
+      self.MASTER: 'Master',
+    }
+    return string_representations[self]
+    
+class Channel(object):
+  _level_range = {
+    'min': -48,
+    'max': 6,
+  }
+  _pan_range = {
+    'min': -64,
+    'max': 64
+  }
+  min_level = _level_range['min']
+  max_level = _level_range['max']
+  min_pan = _pan_range['min']
+  max_pan = _pan_range['max']
+  _registers = {
+    'level': 'channel_level',
+    'pan': 'pan_value',
+    'mute_state': 'channel_mute_state',
+    'solo_state': 'channel_solo_state',
+    'source': 'software_return_source',
+  }
+  _parameters = {
+    'level': 'level',
+    'pan': 'pan',
+    'mute': 'mute_state',
+    'solo': 'solo_state',
+    'source': 'source',
+  }
+  # The master channel doesn't have mute and solo, and only the software return has a source
+  mute_state = _register_property('channel_mute_state')
+  solo_state = _register_property('channel_solo_state')
+
+  __slots__ = ('_device', 'index', 'type_')
+
+  def __init__(self, device, index, type_):
+    self._device = device
+    self.index = index
+    self.type_ = type_
+
+  @property
+  def level(self):
+    return self._device.get_channel_level(self)
+
+  @level.setter
+  def level(self, value):
+    self._device.cancel_ramp(self, 'level')
+    self._device.queue_channel_level(self, value)
+
+  # Fades the level to the given one in duration seconds, returns the Ramp
+  def fade_to(self, level, duration):
+    return self._device.ramp(self, 'level', level, duration)
+
+  @property
+  def pan(self):
+    return self._device.get_pan_value(self)
+
+  @pan.setter
+  def pan(self, value):
+    self._device.cancel_ramp(self, 'pan')
+    self._device.queue_pan_value(self, value)
+
+  @property
+  def source(self):
+    return self._device.get_software_return_source(self)
+    
+  @source.setter
+  def source(self, value):
+    self._device.set_software_return_source(self, SoftwareReturnSource(value))
+
+  def toggle_mute(self):
+    self._device.set_channel_mute_state(self, State(not self.mute_state))
+
+  def toggle_solo(self):
+    self._device.set_channel_solo_state(self, State(not self.solo_state))
+
+class Layout(namedtuple('Layout', 'inputs outputs mixer')):
+  # How many inputs a device has, the OutputType of each output and the ChannelType of each mixer channel
+  __slots__ = ()
+
+  def to_json(self):
+    return {
+      'inputs': self.inputs,
+      'outputs': [type_.name for type_ in self.outputs],
+      'mixer': [type_.name for type_ in self.mixer],
+    }
+
+  @classmethod
+  def from_json(cls, data):
+    return cls(data['inputs'], tuple(OutputType[name] for name in data['outputs']),
+      tuple(ChannelType[name] for name in data['mixer']))
+
+# Hardcoded because I haven't implemented how to read inputs and outputs information from interface.
+# The speakers are output 0 and the headphones 1 from what I observed.
+# The mixer channels are input 1, input 2, the software return and the mixer master
+DUET_LAYOUT = Layout(2, (OutputType.SPEAKERS, OutputType.HEADPHONES),
+  (ChannelType.INPUT, ChannelType.INPUT, ChannelType.SOFTWARE_RETURN, ChannelType.MASTER))
+
+
+#
+# Register map
+#
+
+# How a register value is converted from the byte the device uses and back, type is the one of the decoded value
+Codec = namedtuple('Codec', 'decode encode type')
+
+def _enum_codec(enum):
+  return Codec(enum, lambda value: enum(value).value, enum)
+
+def _offset_codec(offset):
+  return Codec(lambda raw: raw + offset, lambda value: value - offset, int)
+
+def _limits(value_range):
+  return (value_range['min'], value_range['max'])
+
+_RAW = Codec(int, int, int)
+_NEGATED = Codec(operator.neg, operator.neg, int)
+_STATE = _enum_codec(State)
+
+# request and limits are dicts keyed by InputType when the register depends on the input type.
+# A shared register holds one value for all its indexes, it's read from the first one and written to all of them.
+# The indexes are the ones of DUET_LAYOUT, _layout_registers() has them for other layouts.
+Register = namedtuple('Register', 'name request indexes codec limits shared')
+
+_REGISTERS = (
+  # Inputs
+  Register('input_type', 22, (0, 1), _enum_codec(InputType), None, False),
+  Register('input_level', {InputType.MICROPHONE: 52, InputType.INSTRUMENT: 62}, (0, 1), _RAW,
+    {type_: _limits(level_range) for type_, level_range in Input._level_range.items()}, False),
+  Register('phantom_power_state', 21, (0, 1), _STATE, None, False),
+  Register('phase_state', 19, (0, 1), _STATE, None, False),
+  Register('softlimit_state', 17, (0, 1), _STATE, None, False),
+  # At least in the case of Apogee Duet, both input are grouped when clicking "group" in any of the two inputs
+  Register('group_state', 68, (0, 1), _STATE, None, True),
+  # Outputs
+  Register('output_level', 51, (0, 1), _NEGATED, _limits(Output._level_range), False),
+  Register('mute_state', 53, (0, 1), _STATE, None, False),
+  Register('dim_state', 64, (0, 1), _STATE, None, False),
+  Register('mono_state', 70, (0, 1), _STATE, None, False),
+  Register('output_source', 83, (0, 1), _enum_codec(OutputSource), None, False),
+  # I noticed that both indexes (left and right channel I guess) change at the same time, 
+  # so I'm assuming that they always have the same type selected
+  Register('speaker_output_type', 182, (0, 1), _enum_codec(SpeakerOutputType), None, True),
+  # Mixer
+  Register('channel_level', 76, (0, 1, 2, 3), _offset_codec(Channel.min_level), _limits(Channel._level_range), False),
+  Register('pan_value', 77, (0, 1), _offset_codec(-Channel.max_pan), _limits(Channel._pan_range), False),
+  Register('channel_mute_state', 79, (0, 1, 2), _STATE, None, False),
+  Register('channel_solo_state', 78, (0, 1, 2), _STATE, None, False),
+  Register('software_return_source', 54, (2,), _enum_codec(SoftwareReturnSource), None, False),
+)
+_REGISTER_MAP = {register.name: register for register in _REGISTERS}
+
+def _register_requests(register):
+  return tuple(register.request.values()) if isinstance(register.request, dict) else (register.request,)
+
+_REGISTERS_BY_REQUEST = {request: register for register in _REGISTERS for request in _register_requests(register)}
+
+_SECTIONS = (('inputs', Input), ('outputs', Output), ('mixer', Channel))
+_REGISTER_SECTIONS = {name: section for section, cls in _SECTIONS for name in cls._registers.values()}
+
+# The channel types that have each mixer register, the rest of them are in every channel
+_CHANNEL_REGISTER_TYPES = {
+  'pan_value': (ChannelType.INPUT,),
+  'channel_mute_state': (ChannelType.INPUT, ChannelType.SOFTWARE_RETURN),
+  'channel_solo_state': (ChannelType.INPUT, ChannelType.SOFTWARE_RETURN),
+  'software_return_source': (ChannelType.SOFTWARE_RETURN,),
+}
+
+# The register map of a device with layout, by name: the indexes of every register are the ones of the inputs,
+# outputs or mixer channels having it. With DUET_LAYOUT they're the ones of _REGISTERS
+def _layout_registers(layout):
+  units = {'inputs': tuple(range(layout.inputs)), 'outputs': tuple(range(len(layout.outputs)))}
+  registers = {}
+  for register in _REGISTERS:
+    section = _REGISTER_SECTIONS[register.name]
+    if section == 'mixer':
+      types = _CHANNEL_REGISTER_TYPES.get(register.name)
+      indexes = tuple(index for index, type_ in enumerate(layout.mixer) if types is None or type_ in types)
+    else:
+      indexes = units[section]
+    registers[register.name] = register._replace(indexes=indexes)
+  return registers
+
+# A parameter of ApogeeDuet.parameters(), type is the one of its values (int or an Enum)
+Parameter = namedtuple('Parameter', 'path target attribute type')
+
+# Sent to the ApogeeDuet subscribers when a register changes, old and new are decoded like the getters do.
+# local is True for the values written from this side and False for the ones changed on the device itself
+RegisterChange = namedtuple('RegisterChange', 'name bRequest wIndex old new local', defaults=(False,))
+
+def _register_index(register, target):
+  return register.indexes[0] if register.shared else target.index
+
+def _register_address(register, target):
+  if isinstance(register.request, dict):
+    type_ = target.type_
+    if type_ not in register.request:
+      raise ValueError('{} is not available for {}'.format(register.name, type_))
+    request = register.request[type_]
+  else:
+    request = register.request
+  return request, _register_index(register, target)
+
+def _check_limits(register, limits, value):
+  if not limits[0] <= value <= limits[1]:
+    raise ValueError('{} must be between {} and {}, not {}'.format(register.name, limits[0], limits[1], value))
+
+# Builds the accessors of a register once, so calling them only costs the transfer 
+# and the conversion of the value
+def _compile_getter(register):
+  request = register.request
+  decode = register.codec.decode
+
+  if isinstance(request, dict):
+    def getter(self, target, fresh=False):
+      type_ = target.type_
+      if type_ not in request:
+        raise ValueError('{} is not available for {}'.format(register.name, type_))
+      return decode(self._get_value_from_device(request[type_], target.index, fresh))
+  elif register.shared:
+    # The indexes are the ones of the layout of the device
+    def getter(self, target=None, fresh=False):
+      return decode(self._get_value_from_device(request, self._register_map[register.name].indexes[0], fresh))
+  else:
+    def getter(self, target, fresh=False):
+      return decode(self._get_value_from_device(request, target.index, fresh))
+  return getter
+
+# write is the name of the ApogeeDuet method receiving (bRequest, wIndex, raw value)
+def _compile_setter(register, write):
+  request, limits = register.request, register.limits
+  encode = register.codec.encode
+
+  if isinstance(request, dict):
+    def setter(self, target, value):
+      type_ = target.type_
+      if type_ not in request:
+        raise ValueError('{} is not available for {}'.format(register.name, type_))
+      _check_limits(register, limits[type_], value)
+      return getattr(self, write)(request[type_], target.index, encode(value))
+  elif register.shared:
+    def setter(self, target, value):
+      if limits is not None:
+        _check_limits(register, limits, value)
+      raw = encode(value)
+      for index in self._register_map[register.name].indexes:
+        result = getattr(self, write)(request, index, raw)
+      return result
+  elif limits is None:
+    def setter(self, target, value):
+      return getattr(self, write)(request, target.index, encode(value))
+  else:
+    def setter(self, target, value):
+      _check_limits(register, limits, value)
+      return getattr(self, write)(request, target.index, encode(value))
+  return setter
+
+class ShadowRegisters(object):
+  # Last known raw value of each register, in a bytearray with one byte per register: the register file.
+  # registers are the (bRequest, wIndex) of its positions, one that isn't there gets a position the first time
+  # it's used. The writes keep it up to date, so reading a register only needs a transfer the first time or when
+  # its value is older than max_age seconds. Copying or comparing the whole state is a byte operation
+  def __init__(self, registers=(), max_age=None):
+    self.max_age = max_age
+    self.registers = list(registers)
+    self._positions = {register: i for i, register in enumerate(self.registers)}
+    self._values = bytearray(len(self.registers))
+    # 1 for the registers with a value
+    self._known = bytearray(len(self.registers))
+    self._updated = array('d', [0.0]) * len(self.registers)
+    self._grow_lock = threading.Lock()
+
+  def _position(self, register):
+    position = self._positions.get(register)
+    if position is None:
+      with self._grow_lock:
+        position = self._positions.get(register)
+        if position is None:
+          self._values.append(0)
+          self._known.append(0)
+          self._updated.append(0.0)
+          self.registers.append(register)
+          position = self._positions[register] = len(self.registers) - 1
+    return position
+
+  # The cached value of a register, None if it isn't cached or it's too old
+  def get(self, register):
+    position = self._positions.get(register)
+    if position is None or not self._known[position]:
+      return None
+    if self.max_age is not None and time.monotonic() - self._updated[position] > self.max_age:
+      return None
+    return self._values[position]
+
+  # The cached value of a register no matter how old it is, None if it isn't cached
+  def peek(self, register):
+    position = self._positions.get(register)
+    if position is None or not self._known[position]:
+      return None
+    return self._values[position]
+
+  def update(self, register, value):
+    position = self._position(register)
+    self._values[position] = value
+    self._known[position] = 1
+    self._updated[position] = time.monotonic()
+
+  def update_many(self, items):
+    for register, value in items:
+      self.update(register, value)
+
+  # Forgets the given registers, or all of them, so the next read gets them from the device
+  def invalidate(self, registers=None):
+    if registers is None:
+      self._known[:] = bytes(len(self._known))
+    else:
+      for register in registers:
+        position = self._positions.get(register)
+        if position is not None:
+          self._known[position] = 0
+
+  # Takes values, bytes in the order of the register file, as the value of its first registers
+  def load(self, values):
+    count = len(values)
+    self._values[:count] = values
+    self._known[:count] = b'\x01' * count
+    now = time.monotonic()
+    for i in range(count):
+      self._updated[i] = now
+
+  # If every register has a value
+  def complete(self):
+    return 0 not in self._known
+
+  # A copy of the register file, the unknown registers are 0
+  def copy(self):
+    return bytes(self._values)
+
+  # The registers whose value in values, bytes in the order of the register file, is different or unknown here.
+  # When nothing changed it's just a compare of the bytes
+  def differences(self, values):
+    count = len(values)
+    if self._values[:count] == values and 0 not in self._known[:count]:
+      return []
+    return [self.registers[i] for i in range(count) if not self._known[i] or self._values[i] != values[i]]
+
+  # Marks the first count registers as just read, for the ones found equal to the device
+  def touch(self, count):
+    now = time.monotonic()
+    for i in range(count):
+      self._updated[i] = now
+
+class ChangePoller(object):
+  # Reads the registers in the background to find the changes made on the device itself (the knob or the touchpads).
+  # A register that changed or was written in the last hot_period seconds is read every fast_interval seconds,
+  # the rest every slow_interval seconds, so the USB cost is bounded by how many registers are being used
+  def __init__(self, device, fast_interval=0.1, slow_interval=2.0, hot_period=5.0):
+    self._device = device
+    self.fast_interval = fast_interval
+    self.slow_interval = slow_interval
+    self.hot_period = hot_period
+    self.reads = 0
+    self.changes = 0
+    self._started = None
+    self._stop = threading.Event()
+    self._thread = None
+
+  def start(self):
+    if self._thread is not None:
+      return
+    self._stop.clear()
+    self._started = time.monotonic()
+    self._thread = threading.Thread(target=self._run, name='ApogeeDuet poller', daemon=True)
+    self._thread.start()
+
+  def stop(self):
+    if self._thread is None:
+      return
+    self._stop.set()
+    if self._thread is not threading.current_thread():
+      self._thread.join()
+    self._thread = None
+
+  # Transfers per second used by the poller since it started
+  def reads_per_second(self):
+    if self._started is None:
+      return 0.0
+    return self.reads / max(time.monotonic() - self._started, 1e-9)
+
+  def _run(self):
+    device = self._device
+    registers = device._snapshot
+    touched = device._touched
+    next_read = dict.fromkeys(registers, time.monotonic())
+    timeout = 0.0
+    while not self._stop.wait(timeout):
+      now = time.monotonic()
+      for register in registers:
+        if next_read[register] > now:
+          continue
+        try:
+          device._poll_register(register)
+        except DeviceDisconnected:
+          # Already logged once, the next polls try to reconnect
+          pass
+        except Exception:
+          logger.exception('Error polling register %s of Apogee Duet', register)
+        self.reads += 1
+        now = time.monotonic()
+        hot = now - touched.get(register, float('-inf')) < self.hot_period
+        next_read[register] = now + (self.fast_interval if hot else self.slow_interval)
+      timeout = max(0.0, min(next_read.values()) - time.monotonic())
+
+class WriteCoalescer(object):
+  # Keeps only the latest value written to each register and writes them at most max_rate times per second.
+  # The timer thread isn't a daemon, so the pending values are still written when a script ends.
+  def __init__(self, write, max_rate):
+    self._write = write
+    self._interval = 1.0 / max_rate
+    self._pending = {}
+    self._lock = threading.Lock()
+    self._flush_lock = threading.Lock()
+    self._timer = None
+    self._last_flush = 0.0
+
+  def put(self, bRequest, wIndex, value):
+    with self._lock:
+      self._pending[bRequest, wIndex] = value
+      if self._timer is None:
+        delay = max(0.0, self._last_flush + self._interval - time.monotonic())
+        self._timer = threading.Timer(delay, self._flush_from_timer)
+        self._timer.start()
+
+  # The value waiting to be written to a register, None if there isn't one
+  def pending(self, bRequest, wIndex):
+    return self._pending.get((bRequest, wIndex))
+
+  # Writes all the pending values now, when it returns every value put before is on the device
+  def flush(self):
+    with self._flush_lock:
+      with self._lock:
+        pending, self._pending = self._pending, {}
+        if self._timer is not None and self._timer is not threading.current_thread():
+          self._timer.cancel()
+        self._timer = None
+        self._last_flush = time.monotonic()
+      for (bRequest, wIndex), value in pending.items():
+        self._write(bRequest, wIndex, value)
+
+  def _flush_from_timer(self):
+    try:
+      self.flush()
+    except Exception:
+      logger.exception('Error writing the pending values to Apogee Duet')
+
+class Ramp(object):
+  # A value going from start to end in duration seconds, returned by ApogeeDuet.ramp().
+  # Its steps are written by the RampScheduler of the device
+  def __init__(self, scheduler, target, attribute, start, end, duration, write):
+    self.target = target
+    self.attribute = attribute
+    self.start = start
+    self.end = end
+    self.duration = duration
+    # Values written, and steps not written because the device was still busy with the previous one
+    self.writes = 0
+    self.skipped = 0
+    self.cancelled = False
+    self._scheduler = scheduler
+    self._write = write
+    self._started = time.monotonic()
+    self._last = start
+    self._future = None
+    self._done = threading.Event()
+
+  # The value the ramp has at a time of time.monotonic()
+  def value_at(self, now):
+    if self.duration <= 0:
+      return self.end
+    progress = min(1.0, (now - self._started) / self.duration)
+    return int(round(self.start + (self.end - self.start) * progress))
+
+  def done(self):
+    return self._done.is_set()
+
+  # Waits until the end value is on the device or the ramp is cancelled, returns False on timeout
+  def wait(self, timeout=None):
+    return self._done.wait(timeout)
+
+  # Stops the ramp where it is, the values already written stay
+  def cancel(self):
+    self._scheduler.cancel(self.target, self.attribute, self)
+
+  # Writes the value for now, returns True when the ramp is over
+  def _step(self, now):
+    if self.cancelled:
+      return True
+    finished = now - self._started >= self.duration
+    if self._future is not None and not self._future.done() and not finished:
+      # The device is behind, the next step writes the value of its own time instead of catching up
+      self.skipped += 1
+      return False
+    value = self.end if finished else self.value_at(now)
+    if value != self._last:
+      self._future = self._write(self.target, value)
+      self._last = value
+      self.writes += 1
+    if finished:
+      # The end value is written even when the last write is still in the worker, they're done in order
+      if self._future is None:
+        self._done.set()
+      else:
+        self._future.add_done_callback(lambda future: self._done.set())
+    return finished
+
+class RampScheduler(object):
+  # Writes the steps of the ramps every interval seconds, paced by time.monotonic() so a slow step
+  # doesn't delay the rest. Like WriteCoalescer the thread isn't a daemon, a script ending in the middle
+  # of a fade still gets the end value, and it only runs while there are ramps
+  def __init__(self, interval):
+    self._interval = interval
+    self._ramps = {}
+    self._changed = threading.Condition()
+    self._added = False
+    self._thread = None
+
+  # Starts a ramp replacing the one of the same attribute of target, if any
+  def start(self, target, attribute, start, end, duration, write):
+    ramp = Ramp(self, target, attribute, start, end, duration, write)
+    with self._changed:
+      old = self._ramps.get((target, attribute))
+      if old is not None:
+        old.cancelled = True
+        old._done.set()
+      self._ramps[target, attribute] = ramp
+      self._added = True
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._run, name='Apogee Duet ramps')
+        self._thread.start()
+      self._changed.notify()
+    return ramp
+
+  # Cancels the ramp of an attribute of target, only if it's still the given one when ramp isn't None
+  def cancel(self, target, attribute, ramp=None):
+    with self._changed:
+      current = self._ramps.get((target, attribute))
+      if current is None or (ramp is not None and current is not ramp):
+        return
+      del self._ramps[target, attribute]
+    current.cancelled = True
+    current._done.set()
+
+  def cancel_all(self):
+    with self._changed:
+      ramps, self._ramps = self._ramps, {}
+    for ramp in ramps.values():
+      ramp.cancelled = True
+      ramp._done.set()
+
+  def _run(self):
+    deadline = time.monotonic()
+    while True:
+      with self._changed:
+        while not self._added:
+          if not self._ramps:
+            self._thread = None
+            return
+          timeout = deadline - time.monotonic()
+          if timeout <= 0:
+            break
+          self._changed.wait(timeout)
+        self._added = False
+        ramps = list(self._ramps.items())
+      now = time.monotonic()
+      for key, ramp in ramps:
+        try:
+          finished = ramp._step(now)
+        except Exception:
+          logger.exception('Error writing a ramp of %s to Apogee Duet', ramp.attribute)
+          ramp.cancelled = finished = True
+          ramp._done.set()
+        if finished:
+          with self._changed:
+            if self._ramps.get(key) is ramp:
+              del self._ramps[key]
+      # The steps missed while this one took too long are skipped, not written late
+      deadline = max(deadline + self._interval, time.monotonic())
+
+class DeviceState(object):
+  # Raw values of every register read by ApogeeDuet.snapshot(), indexed by (bRequest, wIndex).
+  # values is bytes with one byte per register, so two states are compared or stored as bytes
+  __slots__ = ('registers', 'values', '_positions', 'elapsed')
+
+  def __init__(self, registers, values, elapsed, positions=None):
+    object.__setattr__(self, 'registers', tuple(registers))
+    object.__setattr__(self, 'values', bytes(values))
+    if positions is None:
+      positions = {register: i for i, register in enumerate(self.registers)}
+    object.__setattr__(self, '_positions', positions)
+    # Seconds it took to read all the registers from the device
+    object.__setattr__(self, 'elapsed', elapsed)
+
+  def __setattr__(self, name, value):
+    raise AttributeError('DeviceState is immutable')
+
+  def __getitem__(self, register):
+    return self.values[self._positions[register]]
+
+  def __iter__(self):
+    return iter(self.registers)
+
+  def __len__(self):
+    return len(self.values)
+
+  def __eq__(self, other):
+    return isinstance(other, DeviceState) and self.registers == other.registers and self.values == other.values
+
+  def __hash__(self):
+    return hash(self.values)
+
+  def items(self):
+    return zip(self.registers, self.values)
+
+  # The registers with a different value in other, a state of the same registers
+  def diff(self, other):
+    if self.values == other.values:
+      return []
+    return [register for register, mine, theirs in zip(self.registers, self.values, other.values) if mine != theirs]
+
+  # The decoded value of a register for an input, output or channel, like the getters of ApogeeDuet
+  def get(self, name, target):
+    register = _REGISTER_MAP[name]
+    return register.codec.decode(self[_register_address(register, target)])
+
+
+class DeviceWorker(object):
+  # The only thread doing transfers with the device. Jobs with a lower priority number run first,
+  # the ones with the same priority run in the order they were submitted
+  USER = 0
+  READ = 1
+  POLL = 2
+
+  def __init__(self, name):
+    self._queue = queue.PriorityQueue()
+    self._order = itertools.count()
+    self._lock = threading.Lock()
+    self._stopped = False
+    # It isn't a daemon so the writes submitted before a script ends are still done, 
+    # it stops by itself when the main thread is gone and there are no jobs left
+    self._thread = threading.Thread(target=self._run, name=name)
+    self._thread.start()
+
+  # Runs function(*args) in the worker and returns a concurrent.futures.Future with its result
+  def submit(self, priority, function, *args):
+    future = Future()
+    with self._lock:
+      if not self._stopped:
+        self._queue.put((priority, next(self._order), future, function, args))
+        return future
+    # The worker is gone, so nothing else can be using the device
+    self._run_job(future, function, args)
+    return future
+
+  # Like submit() but waiting for the result, it runs right away when called from a job
+  def call(self, priority, function, *args):
+    if self.in_worker():
+      return function(*args)
+    return self.submit(priority, function, *args).result()
+
+  def in_worker(self):
+    return threading.current_thread() is self._thread
+
+  # Waits until every job submitted before with the same or higher priority is done
+  def join(self, priority=POLL):
+    if not self.in_worker():
+      self.submit(priority, lambda: None).result()
+
+  def stop(self):
+    with self._lock:
+      if self._stopped:
+        return
+      self._stopped = True
+      self._queue.put((float('inf'), next(self._order), None, None, None))
+    if not self.in_worker():
+      self._thread.join()
+
+  def _run(self):
+    while True:
+      try:
+        priority, order, future, function, args = self._queue.get(timeout=0.1)
+      except queue.Empty:
+        with self._lock:
+          if self._queue.empty() and not threading.main_thread().is_alive():
+            self._stopped = True
+            return
+        continue
+      if future is None:
+        return
+      self._run_job(future, function, args)
+
+  @staticmethod
+  def _run_job(future, function, args):
+    if not future.set_running_or_notify_cancel():
+      return
+    try:
+      future.set_result(function(*args))
+    except BaseException as e:
+      future.set_exception(e)
+
+# Counters of a register in ApogeeDuet.stats(). calls are the gets or sets of the register, transfers the ones that
+# needed the device. The latencies are in seconds, histogram has the (upper bound, count) of the non empty buckets
+TransferStat = namedtuple('TransferStat', 'name calls transfers errors mean max p50 p99 histogram')
+
+class _Counters(object):
+  __slots__ = ('transfers', 'errors', 'total', 'max', 'histogram')
+
+  def __init__(self, buckets):
+    self.transfers = 0
+    self.errors = 0
+    self.total = 0.0
+    self.max = 0.0
+    self.histogram = [0] * buckets
+
+class TransferStats(object):
+  # Counts the calls and transfers of each (direction, bRequest, wIndex) and how long the transfers take.
+  # The latencies go in buckets of powers of two microseconds, bucket i has the ones under 2**i microseconds,
+  # so recording one is just a few additions
+  READ = 'read'
+  WRITE = 'write'
+  BUCKETS = 32
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._counters = {}
+    # The calls by register are counted in the getters and setters, without the lock to keep them cheap,
+    # once in a while two threads at the same time may count one
+    self.calls = {self.READ: defaultdict(int), self.WRITE: defaultdict(int)}
+    self.started = time.monotonic()
+    self._log_stop = None
+
+  def _get_counters(self, key):
+    counters = self._counters.get(key)
+    if counters is None:
+      counters = self._counters[key] = _Counters(self.BUCKETS)
+    return counters
+
+  def transfer(self, direction, register, elapsed, error=False):
+    bucket = min(int(elapsed * 1e6).bit_length(), self.BUCKETS - 1)
+    with self._lock:
+      counters = self._get_counters((direction,) + register)
+      counters.transfers += 1
+      counters.errors += error
+      counters.total += elapsed
+      counters.max = max(counters.max, elapsed)
+      counters.histogram[bucket] += 1
+
+  def reset(self):
+    with self._lock:
+      self._counters = {}
+      for calls in self.calls.values():
+        calls.clear()
+      self.started = time.monotonic()
+
+  # A TransferStat by (direction, bRequest, wIndex)
+  def snapshot(self):
+    with self._lock:
+      for direction, calls in self.calls.items():
+        for register, count in list(calls.items()):
+          self._get_counters((direction,) + register)
+      counters = {key: (self.calls[key[0]][key[1:]], c.transfers, c.errors, c.total, c.max, tuple(c.histogram)) for key, c in self._counters.items()}
+    stats = {}
+    for key, (calls, transfers, errors, total, max_, histogram) in sorted(counters.items()):
+      register = _REGISTERS_BY_REQUEST.get(key[1])
+      stats[key] = TransferStat(
+        register.name if register is not None else None, calls, transfers, errors,
+        total / transfers if transfers else 0.0, max_,
+        _percentile(histogram, 0.5), _percentile(histogram, 0.99),
+        tuple((2 ** i / 1e6, count) for i, count in enumerate(histogram) if count))
+    return stats
+
+  # One line with the totals and the registers that took the most time, for the log
+  def summary(self, slowest=3):
+    stats = self.snapshot()
+    elapsed = time.monotonic() - self.started
+    reads = sum(stat.transfers for (direction, _, _), stat in stats.items() if direction == self.READ)
+    writes = sum(stat.transfers for (direction, _, _), stat in stats.items() if direction == self.WRITE)
+    errors = sum(stat.errors for stat in stats.values())
+    line = '{} reads, {} writes, {} errors in {:.1f} s'.format(reads, writes, errors, elapsed)
+    by_time = sorted(stats.items(), key=lambda item: item[1].mean * item[1].transfers, reverse=True)[:slowest]
+    if by_time:
+      line += ', most time in ' + ', '.join(
+        '{} {} {}/{} ({} x {:.2f} ms, p99 {:.2f} ms)'.format(stat.name, direction, bRequest, wIndex, stat.transfers, stat.mean * 1000, stat.p99 * 1000)
+        for (direction, bRequest, wIndex), stat in by_time if stat.transfers)
+    return line
+
+  def start_logging(self, interval):
+    self.stop_logging()
+    stop = self._log_stop = threading.Event()
+    def log():
+      while not stop.wait(interval):
+        logger.info('Apogee Duet transfers: %s', self.summary())
+    threading.Thread(target=log, name='Apogee Duet stats', daemon=True).start()
+
+  def stop_logging(self):
+    if self._log_stop is not None:
+      self._log_stop.set()
+      self._log_stop = None
+
+# The upper bound in seconds of the bucket where the q fraction of the latencies is reached
+def _percentile(histogram, q):
+  total = sum(histogram)
+  if not total:
+    return 0.0
+  seen = 0
+  for i, count in enumerate(histogram):
+    seen += count
+    if seen >= q * total:
+      return 2 ** i / 1e6
+  return 2 ** (len(histogram) - 1) / 1e6
+
+#
+# Transports
+#
+
+class TransportError(IOError):
+  pass
+
+# The device isn't there anymore, it was unplugged or the USB bus was reset
+class DeviceDisconnected(TransportError):
+  pass
+
+# The device didn't answer in time
+class TransportTimeout(TransportError):
+  pass
+
+class Transport(object):
+  # What ApogeeDuet needs from the device, the arguments of ctrl_transfer() are the ones of pyusb.
+  # Errors talking with the device are raised as TransportError, DeviceDisconnected when it's gone.
+  # id tells the device from others, for the state cache, None when it can't
+  id = None
+
+  def ctrl_transfer(self, bmRequestType, bRequest, wValue=0, wIndex=0, data_or_wLength=None, timeout=None):
+    raise NotImplementedError
+
+  # Finds the same device again after a DeviceDisconnected, raises DeviceDisconnected while it isn't back
+  def reconnect(self):
+    raise DeviceDisconnected('Apogee Duet can\'t be reconnected')
+
+  def close(self):
+    pass
+
+class PyUsbTransport(Transport):
+  def __init__(self, dev):
+    self._dev = dev
+    # To find the same one after it's plugged again, the address changes but the serial and the port don't
+    self._serial = _serial_number(dev)
+    self._port = (dev.bus, _port_numbers(dev))
+    self._id = self._serial if self._serial is not None else '{}:{}'.format(dev.bus, dev.address)
+
+  # The first device found, or the one with the given id
+  @classmethod
+  def find(cls, idVendor, idProduct, id_=None):
+    if id_ is None:
+      dev = usb.core.find(idVendor=idVendor, idProduct=idProduct)
+      if dev is None:
+        raise ValueError('Apogee Duet not found')
+      return cls(dev)
+    for transport in cls.find_all(idVendor, idProduct):
+      if transport.id == id_:
+        return transport
+    raise ValueError('Apogee Duet {} not found'.format(id_))
+
+  @classmethod
+  def find_all(cls, idVendor, idProduct):
+    return [cls(dev) for dev in usb.core.find(find_all=True, idVendor=idVendor, idProduct=idProduct)]
+
+  # The serial number, or bus:address when it can't be read. It's the one of when the device was found
+  @property
+  def id(self):
+    return self._id
+
+  def ctrl_transfer(self, bmRequestType, bRequest, wValue=0, wIndex=0, data_or_wLength=None, timeout=None):
+    try:
+      return self._dev.ctrl_transfer(bmRequestType, bRequest, wValue, wIndex, data_or_wLength, timeout)
+    except usb.core.USBError as e:
+      if e.errno == errno.ENODEV:
+        raise DeviceDisconnected(str(e)) from e
+      if e.errno == errno.ETIMEDOUT:
+        raise TransportTimeout(str(e)) from e
+      raise TransportError(str(e)) from e
+
+  def reconnect(self):
+    try:
+      usb.util.dispose_resources(self._dev)
+    except usb.core.USBError:
+      pass
+    for dev in usb.core.find(find_all=True, idVendor=self._dev.idVendor, idProduct=self._dev.idProduct):
+      if self._serial is not None:
+        same = _serial_number(dev) == self._serial
+      else:
+        same = (dev.bus, _port_numbers(dev)) == self._port
+      if same:
+        self._dev = dev
+        return
+    raise DeviceDisconnected('Apogee Duet not connected')
+
+  def close(self):
+    usb.util.dispose_resources(self._dev)
+
+# Reading the serial needs permissions on the device and not every backend has the ports, None when they can't be read
+def _serial_number(dev):
+  try:
+    return dev.serial_number
+  except (usb.core.USBError, ValueError, NotImplementedError):
+    return None
+
+def _port_numbers(dev):
+  try:
+    return dev.port_numbers
+  except (usb.core.USBError, NotImplementedError):
+    return None
+
+class SimulatedDuet(Transport):
+  # An Apogee Duet in memory, for trying and measuring things without the hardware. registers has the raw value
+  # of every (bRequest, wIndex), the ones of the registers of layout (DUET_LAYOUT by default) start with the values
+  # below. Every transfer takes latency seconds plus or minus a random jitter, and fails with TransportError when
+  # failure_rate or fail_next() say so
+  _DEFAULTS = {
+    'input_type': InputType.MICROPHONE.value,
+    'output_level': 20,
+    'channel_level': -Channel.min_level,
+    'pan_value': Channel.max_pan,
+  }
+
+  def __init__(self, registers=None, latency=0.0, jitter=0.0, failure_rate=0.0, seed=None, id_='simulated', layout=None):
+    self.id = id_
+    self.layout = layout if layout is not None else DUET_LAYOUT
+    self.registers = self._default_registers()
+    if registers is not None:
+      self.registers.update(registers)
+    self.connected = True
+    # Every plug() is a new device for the USB stack, the transfers fail until reconnect() opens it again
+    self._plugs = self._opened = 0
+    self.latency = latency
+    self.jitter = jitter
+    self.failure_rate = failure_rate
+    self.reads = 0
+    self.writes = 0
+    self._random = random.Random(seed)
+    self._failures = []
+    self._lock = threading.Lock()
+
+  def _default_registers(self):
+    registers = {}
+    for register in _layout_registers(self.layout).values():
+      value = self._DEFAULTS.get(register.name, 0)
+      for request in _register_requests(register):
+        registers.update(((request, index), value) for index in register.indexes)
+    return registers
+
+  # The next count transfers fail, with error if given
+  def fail_next(self, count=1, error=None):
+    with self._lock:
+      self._failures.extend([error or TransportError('Simulated transfer error')] * count)
+
+  # Until plug() every transfer raises DeviceDisconnected, like when the cable is pulled
+  def unplug(self):
+    with self._lock:
+      self.connected = False
+
+  # With reset the registers go back to the defaults, like a device that lost its state
+  def plug(self, reset=False):
+    with self._lock:
+      if reset:
+        self.registers = self._default_registers()
+      self.connected = True
+      self._plugs += 1
+
+  def reconnect(self):
+    with self._lock:
+      if not self.connected:
+        raise DeviceDisconnected('Simulated Apogee Duet not connected')
+      self._opened = self._plugs
+
+  def ctrl_transfer(self, bmRequestType, bRequest, wValue=0, wIndex=0, data_or_wLength=None, timeout=None):
+    delay = self.latency
+    if self.jitter:
+      delay += self._random.uniform(-self.jitter, self.jitter)
+    if delay > 0:
+      time.sleep(delay)
+    with self._lock:
+      if not self.connected or self._opened != self._plugs:
+        raise DeviceDisconnected('No such device')
+      if self._failures:
+        raise self._failures.pop(0)
+      if self.failure_rate and self._random.random() < self.failure_rate:
+        raise TransportError('Simulated transfer error')
+      register = (bRequest, wIndex)
+      if bmRequestType & usb.util.CTRL_IN:
+        self.reads += 1
+        # The real device stalls the requests it doesn't know
+        if register not in self.registers:
+          raise TransportError('Pipe error')
+        return array('B', [self.registers[register]] * data_or_wLength)
+      self.writes += 1
+      self.registers[register] = data_or_wLength[0]
+      return len(data_or_wLength)
+
+# The format of the traces of TracingTransport: a header with TRACE_MAGIC and the time.time() it started, and then
+# a TRACE_RECORD per transfer with the seconds since the start, bmRequestType, bRequest, wIndex, the byte read or
+# written and TRACE_ERROR when it failed. take_control_trace.py reads and replays them
+TRACE_MAGIC = b'TCTRACE1'
+TRACE_HEADER = struct.Struct('<8sd')
+TRACE_RECORD = struct.Struct('<dBBHBB')
+TRACE_ERROR = 1
+
+class TracingTransport(Transport):
+  # Does the transfers with transport and appends every one of them to a trace file at path
+  def __init__(self, transport, path):
+    self.transport = transport
+    self._file = open(path, 'wb')
+    self._file.write(TRACE_HEADER.pack(TRACE_MAGIC, time.time()))
+    self._start = time.perf_counter()
+    self._lock = threading.Lock()
+    self.records = 0
+
+  @property
+  def id(self):
+    return self.transport.id
+
+  def ctrl_transfer(self, bmRequestType, bRequest, wValue=0, wIndex=0, data_or_wLength=None, timeout=None):
+    now = time.perf_counter() - self._start
+    reading = bmRequestType & usb.util.CTRL_IN
+    try:
+      result = self.transport.ctrl_transfer(bmRequestType, bRequest, wValue, wIndex, data_or_wLength, timeout)
+    except TransportError:
+      self._append(now, bmRequestType, bRequest, wIndex, 0 if reading else data_or_wLength[0], TRACE_ERROR)
+      raise
+    self._append(now, bmRequestType, bRequest, wIndex, result[0] if reading else data_or_wLength[0], 0)
+    return result
+
+  def _append(self, *record):
+    data = TRACE_RECORD.pack(*record)
+    with self._lock:
+      self._file.write(data)
+      self.records += 1
+
+  # The records are buffered, this writes them to the file
+  def flush(self):
+    with self._lock:
+      self._file.flush()
+
+  def reconnect(self):
+    self.transport.reconnect()
+
+  def close(self):
+    try:
+      self.transport.close()
+    finally:
+      with self._lock:
+        self._file.close()
+
+# The (register, value) writes without the repeated registers, each one with its last value in the place of its last write.
+# A write to a register with a bRequest in barriers is never moved, the writes before it aren't merged with the ones after it
+def _last_writes(writes, barriers=()):
+  merged = []
+  last = {}
+  for register, message in writes:
+    last.pop(register, None)
+    last[register] = message
+    if register[0] in barriers:
+      merged.extend(last.items())
+      last = {}
+  merged.extend(last.items())
+  return merged
+
+class ApogeeDuet(object):
+  idVendor = 0x0c60
+  idProduct = 0x0016
+  _WRITE = 0x40
+  _READ = 0xc0
+  # The waits between the tries to reconnect double from the min to the max
+  _RECONNECT_MIN_DELAY = 0.005
+  _RECONNECT_MAX_DELAY = 1.0
+  
+  # transport is the device to talk with, by default the Apogee Duet connected by USB.
+  # max_write_rate is how many times per second the values changing quickly (levels and pan) are written at most.
+  # cache_max_age is how many seconds a value read or written is used before reading it again, None for always.
+  # Without preload nothing is read until it's used, so only the transfers needed are done.
+  # When the device is gone, the transfer waiting for it tries to reconnect for reconnect_timeout seconds
+  # layout is the one of DUET_LAYOUT by default, or the one found by take_control_probe.py with a CapabilityStore
+  # as capabilities, the registers read and written are the ones of its inputs, outputs and mixer channels.
+  # With a StateCache as cache the last known state and layout of the device are used right away,
+  # nothing is read before returning, and they're checked against the device in the background. The state is
+  # saved there again on close()
+  def __init__(self, transport=None, max_write_rate=30, cache_max_age=None, preload=True, reconnect_timeout=2.0,
+      layout=None, cache=None, capabilities=None):
+    if transport is None:
+      transport = PyUsbTransport.find(self.idVendor, self.idProduct)
+    self._transport = transport
+    if layout is None and capabilities is not None and transport.id is not None:
+      layout = capabilities.load(transport.id).layout()
+    cached = None
+    if cache is not None and transport.id is not None:
+      cached = cache.load(transport.id)
+      if cached is not None and layout is None:
+        layout = cached.layout
+    self.layout = layout if layout is not None else DUET_LAYOUT
+    self._register_map, self._snapshot, self._snapshot_positions, self._section_registers = _register_tables(self.layout)
+    if cached is not None and cached.registers != self._snapshot:
+      # Saved by another version or with another layout
+      cached = None
+    self._io = DeviceWorker('Apogee Duet I/O')
+    self._writes = WriteCoalescer(self._set_value_on_device, max_write_rate)
+    self._ramps = RampScheduler(1.0 / max_write_rate)
+    self._shadow = ShadowRegisters(self._snapshot, cache_max_age)
+    # Writes submitted to the worker and not done yet, by register
+    self._unwritten = Counter()
+    self._unwritten_lock = threading.Lock()
+    self._local = threading.local()
+    self._subscribers = []
+    # When each register was last written or changed, the poller reads these ones more often
+    self._touched = {}
+    self._poller = None
+    self._stats = TransferStats()
+    # The last value this side wrote to each register, they're written again when a device that lost them comes back
+    self._written = {}
+    self.reconnect_timeout = reconnect_timeout
+    self.connected = True
+    self._reconnecting = False
+    self._reconnect_delay = self._RECONNECT_MIN_DELAY
+    self._next_reconnect = 0.0
+    self._read_calls = self._stats.calls[TransferStats.READ]
+    self._write_calls = self._stats.calls[TransferStats.WRITE]
+    self.startup_state = None
+    self._cache = cache
+    # Done when the cached state was checked against the device, None without one
+    self.verified = None
+    if cached is not None:
+      self._shadow.load(cached.values)
+    elif preload:
+      state = self.startup_state = self.refresh()
+      logger.info('Read %d registers from Apogee Duet in %.1f ms', len(state), state.elapsed * 1000)
+    self.inputs = [Input(device=self, index=index) for index in range(self.layout.inputs)]
+    self.outputs = [Output(device=self, index=index, type_=type_) for index, type_ in enumerate(self.layout.outputs)]
+    self.mixer_channels = [Channel(device=self, index=index, type_=type_) for index, type_ in enumerate(self.layout.mixer)]
+    if cached is not None:
+      self.verified = self._io.submit(DeviceWorker.POLL, self._verify)
+
+  # Reads every known register in a single pass, all the work of deciding what to read is done
+  # once in _snapshot_registers() so the loop is just one transfer per register
+  def snapshot(self):
+    return self._io.call(DeviceWorker.READ, self._read_snapshot)
+
+  # Reads every register again and updates the shadow registers with them, 
+  # the subscribers are told about the ones that changed. Returns the snapshot
+  def refresh(self):
+    return self._io.call(DeviceWorker.READ, self._refresh)
+
+  def _refresh(self):
+    state = self._read_snapshot()
+    self._reconcile(state)
+    return state
+
+  # Takes the values of a snapshot, returns the registers that were different.
+  # The register file is in the same order as the snapshot, only the registers that changed are looked at
+  def _reconcile(self, state):
+    changed = self._shadow.differences(state.values)
+    for register in changed:
+      self._update_from_device(register, state[register])
+    self._shadow.touch(len(state))
+    return changed
+
+  # Checks the state taken from the cache against the device, the subscribers are told about what was different
+  def _verify(self):
+    state = self._read_snapshot()
+    changed = self._reconcile(state)
+    logger.info('Checked the cached state of Apogee Duet in %.1f ms, %d registers were different',
+      state.elapsed * 1000, len(changed))
+    self._save_cache()
+    return changed
+
+  def _save_cache(self):
+    if self._cache is None or self._transport.id is None or not self._shadow.complete():
+      return
+    try:
+      self._cache.save(self._transport.id, self.layout, self._snapshot, self._shadow.copy())
+    except OSError as e:
+      logger.warning('Can\'t save the state of Apogee Duet: %s', e)
+
+  def _read_snapshot(self):
+    registers = self._snapshot
+    read = self._read_transfer
+    start = time.perf_counter()
+    values = bytes(read(register) for register in registers)
+    elapsed = time.perf_counter() - start
+    return DeviceState(registers, values, elapsed, self._snapshot_positions)
+  
+  # Every read USB control transfer with the Apogee seems to follow the same format, just one byte returned.
+  # Unless fresh is True the value comes from the shadow registers when they have it
+  def _get_value_from_device(self, bmRequest, wIndex, fresh=False):
+    self._read_calls[bmRequest, wIndex] += 1
+    # A value that is still waiting to be written is newer than the one on the device
+    pending = self._writes.pending(bmRequest, wIndex)
+    if pending is not None:
+      return pending
+    if not fresh:
+      value = self._shadow.get((bmRequest, wIndex))
+      if value is not None:
+        return value
+    return self._io.call(DeviceWorker.READ, self._read_register, (bmRequest, wIndex))
+
+  # The only places doing transfers, so every one of them is in the stats
+  def _read_transfer(self, register):
+    bmRequest, wIndex = register
+    start = time.perf_counter()
+    try:
+      value = self._ctrl_transfer(self._READ, bmRequest, wIndex, 1)[0]
+    except Exception:
+      self._stats.transfer(TransferStats.READ, register, time.perf_counter() - start, True)
+      raise
+    self._stats.transfer(TransferStats.READ, register, time.perf_counter() - start)
+    return value
+
+  def _write_transfer(self, register, message):
+    bmRequest, wIndex = register
+    start = time.perf_counter()
+    try:
+      if not self._ctrl_transfer(self._WRITE, bmRequest, wIndex, [message]):
+        raise TransportError('Apogee Duet didn\'t accept the value {} for request {} index {}'.format(message, bmRequest, wIndex))
+    except Exception:
+      self._stats.transfer(TransferStats.WRITE, register, time.perf_counter() - start, True)
+      raise
+    self._stats.transfer(TransferStats.WRITE, register, time.perf_counter() - start)
+
+  # A transfer that finds the device gone is tried again once it's reconnected
+  def _ctrl_transfer(self, bmRequestType, bRequest, wIndex, data_or_wLength):
+    # Nothing is done with a device that came back until it's recovered, except the transfers recovering it
+    if not self.connected and not self._reconnecting and not self._reconnect():
+      raise DeviceDisconnected('Apogee Duet not connected')
+    try:
+      return self._transport.ctrl_transfer(bmRequestType, bRequest, 0, wIndex, data_or_wLength)
+    except DeviceDisconnected:
+      if not self._reconnect():
+        raise
+    return self._transport.ctrl_transfer(bmRequestType, bRequest, 0, wIndex, data_or_wLength)
+
+  # Runs in the worker, so nothing else uses the device meanwhile. It keeps trying for reconnect_timeout seconds,
+  # after that the transfers fail right away until the next try, which is later every time up to _RECONNECT_MAX_DELAY.
+  # Returns True when the device is back
+  def _reconnect(self):
+    if self._reconnecting or time.monotonic() < self._next_reconnect:
+      return False
+    if self.connected:
+      logger.warning('Apogee Duet disconnected, reconnecting')
+      self.connected = False
+    self._reconnecting = True
+    try:
+      deadline = time.monotonic() + self.reconnect_timeout
+      while True:
+        try:
+          self._transport.reconnect()
+          start = time.perf_counter()
+          recovered = self._recover()
+          break
+        except TransportError:
+          pass
+        delay = self._reconnect_delay
+        self._reconnect_delay = min(delay * 2, self._RECONNECT_MAX_DELAY)
+        if time.monotonic() + delay > deadline:
+          self._next_reconnect = time.monotonic() + delay
+          return False
+        time.sleep(delay)
+    finally:
+      self._reconnecting = False
+    self.connected = True
+    self._reconnect_delay = self._RECONNECT_MIN_DELAY
+    self._next_reconnect = 0.0
+    logger.warning('Apogee Duet reconnected, %d registers written again and %d updated in %.1f ms',
+      recovered[0], recovered[1], (time.perf_counter() - start) * 1000)
+    return True
+
+  # Compares every register of the device that came back with the shadow registers. The ones this side wrote
+  # are written again if the device lost them, the rest take the value of the device.
+  # Returns how many were written and updated
+  def _recover(self):
+    state = DeviceState(self._snapshot, bytes(self._read_transfer(register) for register in self._snapshot),
+      0.0, self._snapshot_positions)
+    written = updated = 0
+    for register in self._shadow.differences(state.values):
+      known = self._shadow.peek(register)
+      value = state[register]
+      if known is not None and self._written.get(register) == known:
+        self._write_transfer(register, known)
+        written += 1
+      elif self._update_from_device(register, value):
+        updated += 1
+    return written, updated
+
+  # Reads the registers of the given sections ('inputs', 'outputs' or 'mixer', see parameters()) that aren't
+  # known yet, all of them in one job. The GUI loads the page it's showing first and the rest in the background
+  def load(self, *sections):
+    self._io.call(DeviceWorker.READ, self._load, sections)
+
+  # The same as load() but with the priority of the poller, so anything else goes first. Every section is its
+  # own job, a read of the user can get in between. Returns the Future of the last one
+  def load_in_background(self, sections=('inputs', 'outputs', 'mixer')):
+    future = None
+    for section in sections:
+      future = self._io.submit(DeviceWorker.POLL, self._load, (section,))
+    return future
+
+  def _load(self, sections):
+    for section in sections:
+      for register in self._section_registers[section]:
+        if self._shadow.peek(register) is None:
+          self._read_register(register)
+
+  def _read_register(self, register):
+    value = self._read_transfer(register)
+    # A write submitted while reading is newer than what the device had
+    if self._unwritten[register]:
+      return self._shadow.peek(register)
+    self._shadow.update(register, value)
+    return value
+    
+  # The same here for every write USB control transfer. The shadow registers get the value right away and the 
+  # transfer is done by the worker, the returned Future is done when the value is on the device
+  def _set_value_on_device(self, bmRequest, wIndex, message):
+    register = (bmRequest, wIndex)
+    self._write_calls[register] += 1
+    job = getattr(self._local, 'job', None)
+    if job is not None:
+      # What it was before the batch, to roll back to
+      if register not in job.previous:
+        job.previous[register] = self._shadow.get(register)
+        # So the poller doesn't take it back before the batch is written
+        with self._unwritten_lock:
+          self._unwritten[register] += 1
+      job.writes.append((register, message))
+      old = self._shadow.peek(register)
+    else:
+      old = previous = self._shadow.peek(register)
+    self._shadow.update(register, message)
+    self._touched[register] = time.monotonic()
+    if old is not None and old != message:
+      self._notify(bmRequest, wIndex, old, message, True)
+    if job is not None:
+      return None
+    return self._submit_writes([(register, message)], {register: previous})
+
+  # previous has the values of the registers before the writes, they go back to the shadow registers when a write fails
+  def _submit_writes(self, writes, previous):
+    if self._io.in_worker():
+      self._write_registers(writes, previous)
+      return None
+    with self._unwritten_lock:
+      self._unwritten.update(register for register, message in writes)
+    future = self._io.submit(DeviceWorker.USER, self._write_registers, writes, previous, True)
+    future.add_done_callback(self._log_write_error)
+    return future
+
+  def _write_registers(self, writes, previous, submitted=False):
+    # A register can be written more than once, after a failure it goes back to what the device got last
+    previous = dict(previous)
+    try:
+      for i, (register, message) in enumerate(writes):
+        try:
+          self._write_transfer(register, message)
+        except Exception:
+          self._roll_back(writes[i:], previous)
+          raise
+        self._written[register] = message
+        previous[register] = message
+    finally:
+      if submitted:
+        with self._unwritten_lock:
+          self._unwritten.subtract(register for register, message in writes)
+
+  # The registers that weren't written get their previous value back, unless something newer was written since.
+  # Without a previous value it's not known what the device has, so they're read again next time
+  def _roll_back(self, writes, previous):
+    for register, message in writes:
+      if self._shadow.peek(register) != message:
+        continue
+      value = previous.get(register)
+      if value is None:
+        self._shadow.invalidate((register,))
+      else:
+        self._shadow.update(register, value)
+        if value != message:
+          self._notify(register[0], register[1], message, value, True)
+
+  @staticmethod
+  def _log_write_error(future):
+    if not future.cancelled() and future.exception() is not None:
+      logger.error('Error writing to Apogee Duet', exc_info=future.exception())
+
+  # Buffers every write done inside, including the ones of the properties of the inputs, outputs and mixer channels,
+  # and sends them to the worker as a single job at the end, so they're done in order and no other transfer
+  # gets between them. A register written more than once is written once with the last value, in the place
+  # of the last write, and the ones left as they were before aren't written at all. The input type writes stay
+  # where they are, the writes before one of them are done before it, the ones after it after it.
+  # If the block raises nothing is written and the values go back to what they were.
+  # The Future of the job is in batch.future after the block
+  @contextmanager
+  def batch(self):
+    job = getattr(self._local, 'job', None)
+    if job is not None:
+      # Already inside a batch, the writes go with the other ones
+      yield job
+      return
+    # The values queued before go first, so they don't overwrite the ones of the batch later
+    self._writes.flush()
+    job = self._local.job = SimpleNamespace(writes=[], previous={}, future=None)
+    try:
+      try:
+        yield job
+      finally:
+        self._local.job = None
+    except BaseException:
+      self._roll_back(_last_writes(job.writes), job.previous)
+      raise
+    else:
+      # The inputs are ungrouped to change their type and grouped again after it, so those aren't merged
+      current = dict(job.previous)
+      writes = []
+      for register, message in _last_writes(job.writes, (self._register_map['input_type'].request,)):
+        if current[register] != message:
+          writes.append((register, message))
+          current[register] = message
+      if writes:
+        job.future = self._submit_writes(writes, job.previous)
+      else:
+        job.future = Future()
+        job.future.set_result(None)
+    finally:
+      # The submitted writes are counted by _submit_writes() now
+      with self._unwritten_lock:
+        self._unwritten.subtract(list(job.previous))
+
+  # Runs function(*args) in the thread that does all the transfers, returns a concurrent.futures.Future.
+  # Everything done with the device inside function happens without other transfers in between
+  def submit(self, function, *args, priority=DeviceWorker.USER):
+    return self._io.submit(priority, function, *args)
+
+  # Reads a register from the device and tells the subscribers if it isn't the value in the shadow registers
+  def _poll_register(self, register):
+    return self._io.call(DeviceWorker.POLL, self._read_polled_register, register)
+
+  def _read_polled_register(self, register):
+    value = self._read_transfer(register)
+    return self._update_from_device(register, value)
+
+  # Keeps a value just read from the device, returns if it was different from the one in the shadow registers
+  def _update_from_device(self, register, value):
+    bmRequest, wIndex = register
+    # A pending value will overwrite whatever the device has now
+    if self._writes.pending(bmRequest, wIndex) is not None or self._unwritten[register]:
+      return False
+    old = self._shadow.peek(register)
+    self._shadow.update(register, value)
+    if old == value:
+      return False
+    # Changed on the device itself, so what this side wrote isn't the value to restore anymore
+    self._written.pop(register, None)
+    self._touched[register] = time.monotonic()
+    if old is not None:
+      self._notify(bmRequest, wIndex, old, value)
+    return True
+
+  def _notify(self, bmRequest, wIndex, old, new, local=False):
+    if not self._subscribers:
+      return
+    register = _REGISTERS_BY_REQUEST[bmRequest]
+    decode = register.codec.decode
+    change = RegisterChange(register.name, bmRequest, wIndex, decode(old), decode(new), local)
+    for callback in list(self._subscribers):
+      try:
+        callback(change)
+      except Exception:
+        logger.exception('Error in Apogee Duet subscriber %r', callback)
+
+  # callback(change) is called with a RegisterChange every time a register changes: when the poller finds it changed
+  # on the device itself, from the poller thread, and when it's written from this side, from the thread writing it
+  # (the one calling the setter, or the one of the queued writes)
+  def subscribe(self, callback):
+    self._subscribers.append(callback)
+
+  def unsubscribe(self, callback):
+    self._subscribers.remove(callback)
+
+  # Starts reading the registers in the background, see ChangePoller for the arguments
+  def start_polling(self, **kwargs):
+    if self._poller is None:
+      self._poller = ChangePoller(self, **kwargs)
+    self._poller.start()
+    return self._poller
+
+  def stop_polling(self):
+    if self._poller is not None:
+      self._poller.stop()
+
+  def _queue_value_on_device(self, bmRequest, wIndex, message):
+    if getattr(self._local, 'job', None) is not None:
+      # Inside a batch it's written with the rest
+      self._set_value_on_device(bmRequest, wIndex, message)
+    else:
+      self._writes.put(bmRequest, wIndex, message)
+
+  # The (bRequest, wIndex) register behind an attribute of an input, output or channel
+  def register_of(self, target, attribute):
+    return _register_address(self._register_map[target._registers[attribute]], target)
+
+  # Only the wIndex of that register, it doesn't depend on the type of the input like the bRequest
+  def index_of(self, target, attribute):
+    return _register_index(self._register_map[target._registers[attribute]], target)
+
+  # Every Parameter of the inputs, outputs and mixer channels by its path, like 'outputs.2.level'.
+  # The numbers start at 1 like in the GUI
+  def parameters(self):
+    parameters = {}
+    for section, targets in (('inputs', self.inputs), ('outputs', self.outputs), ('mixer', self.mixer_channels)):
+      for number, target in enumerate(targets, 1):
+        for name, attribute in target._parameters.items():
+          register = self._register_map[target._registers[attribute]]
+          # Not every channel has all the parameters, like the master channel without mute
+          if register.shared or target.index in register.indexes:
+            path = '{}.{}.{}'.format(section, number, name)
+            parameters[path] = Parameter(path, target, attribute, register.codec.type)
+    return parameters
+
+  # The raw value of every register as this side knows it, by (bRequest, wIndex). 
+  # Only the registers that were never read are read from the device
+  def capture(self):
+    if not self._shadow.complete():
+      self.refresh()
+    values = dict(zip(self._snapshot, self._shadow.copy()))
+    for register in values:
+      pending = self._writes.pending(*register)
+      if pending is not None:
+        values[register] = pending
+    return values
+
+  # Saves the state of the inputs, outputs and mixer channels as a Preset
+  def save_preset(self, name):
+    return Preset(name, self.capture())
+
+  # Writes only the registers of the preset that are different from the current state, in the order of _recall_writes().
+  # Returns the Future of the writes, which are done as a single job
+  def recall_preset(self, preset):
+    writes = _recall_writes(preset.registers, self.capture(), self._register_map)
+    with self.batch() as job:
+      for (bmRequest, wIndex), value in writes:
+        self._set_value_on_device(bmRequest, wIndex, value)
+    return job.future
+
+  # Takes an attribute of target (like the level of an output or a mixer channel) from its current value to value
+  # in duration seconds, at most max_write_rate steps per second. A ramp of the same attribute is replaced,
+  # setting it stops the ramp. Returns the Ramp, its wait() returns when value is on the device
+  def ramp(self, target, attribute, value, duration):
+    register = _REGISTER_MAP[target._registers[attribute]]
+    if register.codec.type is not int:
+      raise ValueError('{} can\'t be ramped'.format(register.name))
+    # What's queued goes first, so it doesn't get written in the middle of the ramp
+    self._writes.flush()
+    # Raises ValueError when the target doesn't have it, like an input level for the line type
+    start = getattr(self, 'get_' + register.name)(target)
+    limits = register.limits[target.type_] if isinstance(register.request, dict) else register.limits
+    _check_limits(register, limits, value)
+    write = getattr(self, '_set_' + register.name)
+    return self._ramps.start(target, attribute, start, value, max(0.0, duration), write)
+
+  def cancel_ramp(self, target, attribute):
+    self._ramps.cancel(target, attribute)
+
+  # Makes the next reads of the given (bRequest, wIndex) registers, or all of them, get the value from the device
+  def invalidate(self, registers=None):
+    self._shadow.invalidate(registers)
+
+  # Writes the values queued by the queue_<name>() methods and waits for every write done before,
+  # scripts can call it to know they're on the device
+  def flush(self):
+    self._writes.flush()
+    self._io.join(DeviceWorker.USER)
+
+  # The calls, transfers, errors and latencies of every register by (direction, bRequest, wIndex),
+  # direction being 'read' or 'write'. See TransferStat
+  def stats(self):
+    return self._stats.snapshot()
+
+  # The totals of stats() in one line, with the registers that took the most time
+  def stats_summary(self):
+    return self._stats.summary()
+
+  def reset_stats(self):
+    self._stats.reset()
+
+  # Logs a line with the totals of stats() every interval seconds, with the INFO level of the apogee_duet logger
+  def start_stats_log(self, interval=60.0):
+    self._stats.start_logging(interval)
+
+  def stop_stats_log(self):
+    self._stats.stop_logging()
+
+  def close(self):
+    self.stop_stats_log()
+    self.stop_polling()
+    self._ramps.cancel_all()
+    self.flush()
+    self._io.stop()
+    # With every write done
+    self._save_cache()
+    self._transport.close()
+
+  # Every register of _REGISTERS gets a get_<name>(target, fresh=False) and set_<name>(target, value) method, 
+  # and a queue_<name>(target, value) one that coalesces the writes done faster than max_write_rate.
+  # The setters return the Future of the write. These are the ones with something more to do than writing the value
+
+  def set_input_type(self, input_, new_type):
+    # The official app ungroups the inputs before changing the input type, 
+    # the ungroup has to be on the device before the new type
+    with self.batch() as job:
+      self.set_group_state(State.DISABLED)
+      self._set_input_type(input_, new_type)
+    return job.future
+
+  def set_group_state(self, state):
+    return self._set_group_state(None, state)
+
+#
+# Presets
+#
+
+# Order the registers of a preset are written in: the input type before anything depending on it,
+# the group after the type (changing it ungroups the inputs) and the levels at the end
+_RECALL_ORDER = (
+  'input_type',
+  'group_state',
+  'phantom_power_state',
+  'phase_state',
+  'softlimit_state',
+  'output_source',
+  'speaker_output_type',
+  'software_return_source',
+  'mute_state',
+  'dim_state',
+  'mono_state',
+  'channel_mute_state',
+  'channel_solo_state',
+  'input_level',
+  'output_level',
+  'channel_level',
+  'pan_value',
+)
+
+# The (register, value) writes that take the device from the current raw values to the ones of the preset
+# registers is the register map of the layout of the device, a preset saved with another one only writes the
+# registers both have
+def _recall_writes(preset, current, registers=_REGISTER_MAP):
+  current = dict(current)
+  writes = []
+  def write(register, value):
+    if value is not None and current.get(register) != value:
+      writes.append((register, value))
+      current[register] = value
+
+  input_type = registers['input_type']
+  group = registers['group_state']
+  types = {index: InputType(preset.get((input_type.request, index), current[input_type.request, index]))
+    for index in input_type.indexes}
+  if any(current.get((input_type.request, index)) != type_.value for index, type_ in types.items()):
+    # The official app ungroups the inputs before changing the input type
+    for index in group.indexes:
+      write((group.request, index), State.DISABLED.value)
+  for name in _RECALL_ORDER:
+    register = registers[name]
+    for index in register.indexes:
+      if isinstance(register.request, dict):
+        # Only the level of the type the input will have, a line input doesn't have one
+        if types[index] not in register.request:
+          continue
+        request = register.request[types[index]]
+      elif name == 'phantom_power_state' and types[index] != InputType.MICROPHONE:
+        continue
+      else:
+        request = register.request
+      write((request, index), preset.get((request, index)))
+  return writes
+
+class Preset(object):
+  # The raw value of every register, by (bRequest, wIndex), see ApogeeDuet.save_preset() and recall_preset()
+  def __init__(self, name, registers):
+    self.name = name
+    self.registers = dict(registers)
+
+  def to_json(self):
+    return {
+      'name': self.name,
+      'registers': [[bRequest, wIndex, value] for (bRequest, wIndex), value in sorted(self.registers.items())],
+    }
+
+  @classmethod
+  def from_json(cls, data):
+    return cls(data['name'], {(bRequest, wIndex): value for bRequest, wIndex, value in data['registers']})
+
+class PresetStore(object):
+  # The presets saved as JSON files in a directory, by default ~/.config/take_control/presets
+  def __init__(self, directory=None):
+    if directory is None:
+      directory = os.path.join(os.path.expanduser('~'), '.config', 'take_control', 'presets')
+    self.directory = directory
+
+  def _path(self, name):
+    if not name or os.sep in name or name.startswith('.'):
+      raise ValueError('Invalid preset name: {}'.format(name))
+    return os.path.join(self.directory, name + '.json')
+
+  def names(self):
+    if not os.path.isdir(self.directory):
+      return []
+    return sorted(f[:-len('.json')] for f in os.listdir(self.directory) if f.endswith('.json'))
+
+  def save(self, preset):
+    os.makedirs(self.directory, exist_ok=True)
+    path = self._path(preset.name)
+    # Written next to it and renamed, so a preset is never left half written
+    with open(path + '.tmp', 'w') as f:
+      json.dump(preset.to_json(), f, indent=2)
+    os.replace(path + '.tmp', path)
+
+  def load(self, name):
+    try:
+      with open(self._path(name)) as f:
+        return Preset.from_json(json.load(f))
+    except FileNotFoundError:
+      raise ValueError('Preset not found: {}'.format(name))
+
+  def delete(self, name):
+    try:
+      os.remove(self._path(name))
+    except FileNotFoundError:
+      raise ValueError('Preset not found: {}'.format(name))
+
+#
+# State cache
+#
+
+def _cache_directory():
+  base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+  return os.path.join(base, 'take_control')
+
+# The file of a device in directory, the ids are serial numbers and bus:address so only what's safe in a file name is kept
+def _device_path(directory, kind, id_):
+  name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in id_)
+  return os.path.join(directory, '{}-{}.json'.format(kind, name))
+
+# Written next to it and renamed, so it's never left half written
+def _write_json(path, data):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(path + '.tmp', 'w') as f:
+    json.dump(data, f)
+  os.replace(path + '.tmp', path)
+
+# A state read from StateCache, values has the raw value of each (bRequest, wIndex) of registers, in that order
+CachedState = namedtuple('CachedState', 'layout registers values')
+
+class StateCache(object):
+  # The last known state and layout of each device by its id, as JSON files in a directory, by default
+  # ~/.cache/take_control. ApogeeDuet starts with it and checks it against the device in the background
+  def __init__(self, directory=None):
+    self.directory = directory if directory is not None else _cache_directory()
+
+  def _path(self, id_):
+    return _device_path(self.directory, 'state', id_)
+
+  # The CachedState of a device, None if there's none. It can have other registers than the device now
+  # (saved by another version or with another layout), ApogeeDuet doesn't use it then
+  def load(self, id_):
+    try:
+      with open(self._path(id_)) as f:
+        data = json.load(f)
+      registers = tuple(tuple(register) for register in data['registers'])
+      values = bytes.fromhex(data['values'])
+      if len(values) != len(registers):
+        raise ValueError('{} values for {} registers'.format(len(values), len(registers)))
+      return CachedState(Layout.from_json(data['layout']), registers, values)
+    except FileNotFoundError:
+      return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+      logger.warning('Ignoring the cached state of %s: %s', id_, e)
+      return None
+
+  def save(self, id_, layout, registers, values):
+    _write_json(self._path(id_), {
+      'id': id_,
+      'layout': layout.to_json(),
+      'registers': [list(register) for register in registers],
+      # One byte per register, as hex
+      'values': bytes(values).hex(),
+    })
+
+#
+# Capabilities
+#
+
+# The registers every input, output and mixer channel has, and the ones telling the type of a mixer channel
+_UNIT_REGISTERS = {
+  'inputs': ('input_type', 'phantom_power_state', 'phase_state', 'softlimit_state'),
+  'outputs': ('output_level', 'mute_state', 'dim_state', 'mono_state', 'output_source'),
+  'mixer': ('channel_level',),
+}
+_CHANNEL_TYPE_REGISTERS = ('pan_value', 'software_return_source')
+
+class Capabilities(object):
+  # What a device answers to read requests, found by take_control_probe.py. values has the byte read of every
+  # (bRequest, wIndex) that answered and stalled the ones the device refused. The ones that timed out are
+  # in neither, so they're probed again
+  def __init__(self, values=None, stalled=()):
+    self.values = dict(values or {})
+    self.stalled = set(stalled)
+
+  def probed(self, register):
+    return register in self.values or register in self.stalled
+
+  # The requests answered that aren't in the register map, the ones left to find out
+  def unknown(self):
+    return sorted(register for register in self.values if register[0] not in _REGISTERS_BY_REQUEST)
+
+  # Whether the device answered a valid value of the register at index
+  def _answers(self, name, index):
+    register = _REGISTER_MAP[name]
+    value = self.values.get((register.request, index))
+    if value is None:
+      return False
+    try:
+      value = register.codec.decode(value)
+    except ValueError:
+      return False
+    return register.limits is None or register.limits[0] <= value <= register.limits[1]
+
+  # The Layout of the device, None when the indexes of the register map weren't probed yet. Beyond them a wIndex
+  # is an input, output or mixer channel when it answers every register they all have, and the first one that
+  # doesn't ends them, the models are numbered from 0 like the wIndex
+  def layout(self):
+    for name in _UNIT_REGISTERS['inputs'] + _UNIT_REGISTERS['outputs'] + _UNIT_REGISTERS['mixer'] + _CHANNEL_TYPE_REGISTERS:
+      register = _REGISTER_MAP[name]
+      if not all(self.probed((register.request, index)) for index in register.indexes):
+        return None
+    counts = {}
+    for section, names in _UNIT_REGISTERS.items():
+      count = 0
+      while all(self._answers(name, count) for name in names):
+        count += 1
+      counts[section] = count
+    # No register tells the speakers from the headphones, the first output is the speakers like in the Apogee Duet
+    outputs = tuple(OutputType.SPEAKERS if index == 0 else OutputType.HEADPHONES for index in range(counts['outputs']))
+    # The channels of the inputs have pan, the software return a source and the master neither
+    mixer = tuple(ChannelType.INPUT if self._answers('pan_value', index) else
+      ChannelType.SOFTWARE_RETURN if self._answers('software_return_source', index) else ChannelType.MASTER
+      for index in range(counts['mixer']))
+    return Layout(counts['inputs'], outputs, mixer)
+
+  def to_json(self):
+    return {
+      'values': [[bRequest, wIndex, value] for (bRequest, wIndex), value in sorted(self.values.items())],
+      'stalled': [list(register) for register in sorted(self.stalled)],
+    }
+
+  @classmethod
+  def from_json(cls, data):
+    return cls({(bRequest, wIndex): value for bRequest, wIndex, value in data['values']},
+      (tuple(register) for register in data['stalled']))
+
+class CapabilityStore(object):
+  # The Capabilities of each device by its id, as JSON files in a directory, by default ~/.cache/take_control
+  def __init__(self, directory=None):
+    self.directory = directory if directory is not None else _cache_directory()
+
+  def _path(self, id_):
+    return _device_path(self.directory, 'capabilities', id_)
+
+  # Empty ones when the device wasn't probed yet
+  def load(self, id_):
+    try:
+      with open(self._path(id_)) as f:
+        return Capabilities.from_json(json.load(f))
+    except FileNotFoundError:
+      return Capabilities()
+    except (OSError, ValueError, KeyError, TypeError) as e:
+      logger.warning('Ignoring the capabilities of %s: %s', id_, e)
+      return Capabilities()
+
+  def save(self, id_, capabilities):
+    _write_json(self._path(id_), dict(capabilities.to_json(), id=id_))
+
+#
+# Several devices
+#
+
+class DuetManager(object):
+  # Every Apogee Duet connected, each one with its own ApogeeDuet and so its own worker, so what's done with
+  # one doesn't wait for the others. transports is a dict of Transport by id, by default the ones of all the
+  # Apogee Duets connected by USB by their serial number or bus:address. The rest of the arguments go to ApogeeDuet
+  def __init__(self, transports=None, **kwargs):
+    if transports is None:
+      transports = {transport.id: transport for transport in PyUsbTransport.find_all(ApogeeDuet.idVendor, ApogeeDuet.idProduct)}
+    self._executor = ThreadPoolExecutor(max_workers=max(1, len(transports)), thread_name_prefix='Apogee Duet manager')
+    # Opened at the same time, each one reads its registers meanwhile
+    futures = {id_: self._executor.submit(ApogeeDuet, transport, **kwargs) for id_, transport in transports.items()}
+    self.devices = {}
+    try:
+      for id_, future in futures.items():
+        self.devices[id_] = future.result()
+    except BaseException:
+      for future in futures.values():
+        if future.exception() is None:
+          future.result().close()
+      self._executor.shutdown()
+      raise
+
+  def __getitem__(self, id_):
+    return self.devices[id_]
+
+  def __iter__(self):
+    return iter(self.devices)
+
+  def __len__(self):
+    return len(self.devices)
+
+  def items(self):
+    return self.devices.items()
+
+  # Runs function(device, *args) for every device at the same time, returns the concurrent.futures.Future of each by id
+  def fan_out(self, function, *args):
+    return {id_: self._executor.submit(function, device, *args) for id_, device in self.devices.items()}
+
+  # Like fan_out() but waiting for all of them, returns the results by id. When some fail the first error
+  # is raised, after all of them finished
+  def call(self, function, *args):
+    futures = self.fan_out(function, *args)
+    results = {}
+    error = None
+    for id_, future in futures.items():
+      try:
+        results[id_] = future.result()
+      except Exception as e:
+        if error is None:
+          error = e
+        else:
+          # Only the first one is raised, the rest would be lost
+          logger.error('Error in Apogee Duet %s', id_, exc_info=e)
+    if error is not None:
+      raise error
+    return results
+
+  # Sets a parameter of ApogeeDuet.parameters(), like 'outputs.2.level', on every device and waits until it's written
+  def set(self, path, value):
+    def set_on(device):
+      try:
+        parameter = device.parameters()[path]
+      except KeyError:
+        raise ValueError('Unknown parameter {}'.format(path)) from None
+      setattr(parameter.target, parameter.attribute, value)
+      device.flush()
+    self.call(set_on)
+
+  def close(self):
+    try:
+      self.call(ApogeeDuet.close)
+    finally:
+      self._executor.shutdown()
+
+class AsyncApogeeDuet(object):
+  # asyncio front-end for ApogeeDuet. The same Input, Output and Channel objects are wrapped in AsyncTarget,
+  # everything touching the device runs in the single I/O worker thread of ApogeeDuet and is awaited from there.
+  # asyncio is imported by the methods because otherwise it takes most of the import time of this module
+  def __init__(self, device):
+    self.device = device
+    self.inputs = [AsyncTarget(self, input_) for input_ in device.inputs]
+    self.outputs = [AsyncTarget(self, output) for output in device.outputs]
+    self.mixer_channels = [AsyncTarget(self, channel) for channel in device.mixer_channels]
+
+  # Opens the device without blocking the event loop, kwargs are the ones of ApogeeDuet
+  @classmethod
+  async def open(cls, **kwargs):
+    import asyncio
+    loop = asyncio.get_running_loop()
+    device = await loop.run_in_executor(None, functools.partial(ApogeeDuet, **kwargs))
+    return cls(device)
+
+  async def run(self, function, *args, priority=DeviceWorker.USER):
+    import asyncio
+    return await asyncio.wrap_future(self.device.submit(function, *args, priority=priority))
+
+  # Reads many (target, attribute) pairs, where target can be an AsyncTarget, in one job of the worker.
+  # With fresh the values come from the device and not from the shadow registers
+  async def gather(self, *reads, fresh=False):
+    reads = [(getattr(target, 'model', target), attribute) for target, attribute in reads]
+    return await self.run(self._read_all, reads, fresh, priority=DeviceWorker.READ)
+
+  async def flush(self):
+    import asyncio
+    await asyncio.get_running_loop().run_in_executor(None, self.device.flush)
+
+  async def close(self):
+    import asyncio
+    await asyncio.get_running_loop().run_in_executor(None, self.device.close)
+
+  def _read_all(self, reads, fresh):
+    device = self.device
+    if fresh:
+      device.invalidate([device.register_of(target, attribute) for target, attribute in reads])
+    return [getattr(target, attribute) for target, attribute in reads]
+
+  # Runs function(*args) in the worker and waits until the writes it did are on the device
+  async def _run_writing(self, function, *args):
+    result = await self.run(self._flushing, function, args)
+    # The coalesced writes the timer was doing are submitted by now, this job runs after them
+    await self.run(lambda: None)
+    return result
+
+  def _flushing(self, function, args):
+    result = function(*args)
+    self.device._writes.flush()
+    return result
+
+class AsyncTarget(object):
+  # An Input, Output or Channel with awaitable reads and writes, the rest of the attributes come from the model
+  def __init__(self, duet, model):
+    self._duet = duet
+    self.model = model
+
+  def __getattr__(self, name):
+    return getattr(self.model, name)
+
+  async def get(self, attribute, fresh=False):
+    values = await self._duet.gather((self.model, attribute), fresh=fresh)
+    return values[0]
+
+  async def set(self, attribute, value):
+    await self._duet._run_writing(setattr, self.model, attribute, value)
+
+  # Calls a method of the model like toggle_mute()
+  async def call(self, method, *args):
+    return await self._duet._run_writing(getattr(self.model, method), *args)
+
+def _snapshot_registers(registers):
+  addresses = []
+  for register in registers:
+    requests = _register_requests(register)
+    # Registers depending on the input type are read for all the types, so the type isn't needed first
+    addresses.extend((request, index) for request in requests for index in register.indexes)
+  return tuple(addresses)
+
+# The register map of a layout, every (bRequest, wIndex) a snapshot reads in order, their positions in it, and the
+# ones of each section with the names parameters() uses. There's only one per layout, devices share them
+RegisterTables = namedtuple('RegisterTables', 'registers snapshot positions sections')
+
+@functools.lru_cache(maxsize=None)
+def _register_tables(layout):
+  registers = _layout_registers(layout)
+  snapshot = _snapshot_registers(registers.values())
+  return RegisterTables(
+    registers,
+    snapshot,
+    {register: i for i, register in enumerate(snapshot)},
+    {section: _snapshot_registers(register for register in registers.values() if _REGISTER_SECTIONS[register.name] == section)
+      for section, cls in _SECTIONS},
+  )
+
+def _install_accessors(cls, registers):
+  for register in registers:
+    accessors = (
+      ('get_', _compile_getter(register)),
+      ('set_', _compile_setter(register, '_set_value_on_device')),
+      ('queue_', _compile_setter(register, '_queue_value_on_device')),
+    )
+    for prefix, accessor in accessors:
+      name = prefix + register.name
+      accessor.__name__ = name
+      # The private one is always available for the methods wrapping it
+      setattr(cls, '_' + name, accessor)
+      if name not in cls.__dict__:
+        setattr(cls, name, accessor)
+
+_install_accessors(ApogeeDuet, _REGISTERS)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+# Benchmarks for take_control: import time of the core and the GUI, and the rest against the simulated Apogee Duet or the real one.
+# The results are printed as JSON so runs before and after a change can be compared:
+#   $ ./benchmark.py --output before.json
+#   $ sudo ./benchmark.py --transport usb
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from apogee_duet import ApogeeDuet, SimulatedDuet, State
+
+def summary(samples):
+  ordered = sorted(samples)
+  def percentile(p):
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+  return {
+    'count': len(ordered),
+    'min': ordered[0],
+    'mean': statistics.mean(ordered),
+    'p50': percentile(50),
+    'p99': percentile(99),
+    'max': ordered[-1],
+  }
+
+def make_transport(args):
+  if args.transport == 'usb':
+    return None
+  return SimulatedDuet(latency=args.latency, jitter=args.jitter, seed=args.seed)
+
+def transfers(transport):
+  return None if transport is None else transport.reads + transport.writes
+
+# Each import is measured in a new interpreter, so nothing is already imported
+def bench_imports(args):
+  results = {}
+  for name, module in (('core', 'apogee_duet'), ('gui', 'take_control_gui')):
+    code = 'import time; start = time.perf_counter(); import {}; print(time.perf_counter() - start)'.format(module)
+    samples = []
+    for i in range(args.import_runs):
+      process = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+      if process.returncode != 0:
+        break
+      samples.append(float(process.stdout))
+    if samples:
+      results[name] = summary(samples)
+    else:
+      results[name] = {'skipped': process.stderr.strip().splitlines()[-1]}
+  return results
+
+def bench_startup(args):
+  samples = []
+  snapshot_samples = []
+  for i in range(args.startup_runs):
+    start = time.perf_counter()
+    device = ApogeeDuet(transport=make_transport(args))
+    samples.append(time.perf_counter() - start)
+    snapshot_samples.append(device.startup_state.elapsed)
+    device.close()
+  # What the GUI waits for before showing the window, only the first page is read
+  first_page_samples = []
+  for i in range(args.startup_runs):
+    start = time.perf_counter()
+    device = ApogeeDuet(transport=make_transport(args), preload=False)
+    device.load('inputs')
+    first_page_samples.append(time.perf_counter() - start)
+    device.close()
+  return {'construction': summary(samples), 'snapshot': summary(snapshot_samples), 'first_page': summary(first_page_samples)}
+
+def bench_get(device, args):
+  output = device.outputs[1]
+  cached = []
+  fresh = []
+  for i in range(args.calls):
+    start = time.perf_counter()
+    device.get_output_level(output)
+    cached.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    device.get_output_level(output, fresh=True)
+    fresh.append(time.perf_counter() - start)
+  return {'cached': summary(cached), 'fresh': summary(fresh)}
+
+def bench_set(device, args):
+  output = device.outputs[1]
+  submit = []
+  complete = []
+  for i in range(args.calls):
+    state = State(i % 2)
+    start = time.perf_counter()
+    future = device.set_dim_state(output, state)
+    submit.append(time.perf_counter() - start)
+    future.result()
+    complete.append(time.perf_counter() - start)
+  return {'submit': summary(submit), 'complete': summary(complete)}
+
+def sweep(device, transport, target, values):
+  before = transfers(transport)
+  start = time.perf_counter()
+  for value in values:
+    target.level = value
+  device.flush()
+  elapsed = time.perf_counter() - start
+  after = transfers(transport)
+  return {
+    'values': len(values),
+    'seconds': elapsed,
+    'values_per_second': len(values) / elapsed,
+    'transfers': None if before is None else after - before,
+  }
+
+def bench_sweeps(device, transport, args):
+  input_ = device.inputs[0]
+  output = device.outputs[1]
+  channel = device.mixer_channels[0]
+  results = {}
+  for name, target in (('input', input_), ('output', output), ('channel', channel)):
+    values = list(range(target.min_level, target.max_level + 1)) * args.sweeps
+    results[name] = sweep(device, transport, target, values)
+  return results
+
+def bench_main_frame(args):
+  try:
+    import wx
+    import take_control_gui
+  except ImportError as e:
+    return {'skipped': str(e)}
+  app = wx.App()
+  samples = []
+  for i in range(args.startup_runs):
+    start = time.perf_counter()
+    # Always a cold start, and nothing is left in the cache of the user
+    frame = take_control_gui.MainFrame(transport=make_transport(args), cache=None)
+    samples.append(time.perf_counter() - start)
+    # It closes the device too
+    frame.Close()
+    frame.Destroy()
+  app.Destroy()
+  return summary(samples)
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark take_control')
+  parser.add_argument('--transport', choices=('simulated', 'usb'), default='simulated')
+  parser.add_argument('--latency', type=float, default=0.0005, help='Seconds per simulated transfer')
+  parser.add_argument('--jitter', type=float, default=0.0001, help='Random seconds added or removed per simulated transfer')
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--import-runs', type=int, default=5)
+  parser.add_argument('--startup-runs', type=int, default=10)
+  parser.add_argument('--calls', type=int, default=200, help='Calls measured for the get and set latencies')
+  parser.add_argument('--sweeps', type=int, default=3, help='Times each full level range is swept')
+  parser.add_argument('--no-gui', action='store_true', help="Don't measure building MainFrame")
+  parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+  args = parser.parse_args()
+
+  results = {'imports': bench_imports(args), 'startup': bench_startup(args)}
+  transport = make_transport(args)
+  device = ApogeeDuet(transport=transport)
+  try:
+    results['get'] = bench_get(device, args)
+    results['set'] = bench_set(device, args)
+    results['sweeps'] = bench_sweeps(device, transport, args)
+  finally:
+    device.close()
+  if not args.no_gui:
+    results['main_frame'] = bench_main_frame(args)
+
+  report = {
+    'python': platform.python_version(),
+    'platform': platform.platform(),
+    'arguments': vars(args),
+    'results': results,
+  }
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent=2)
+  else:
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+if __name__ == '__main__':
+  main()
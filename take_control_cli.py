@@ -0,0 +1,314 @@
+# Command line control of the Apogee Duet, for scripts. It doesn't need wx and only does the transfers
+# the command needs, all the assignments of one run share the same device:
+#   $ sudo ./take_control.py get outputs.2.level
+#   $ sudo ./take_control.py set inputs.1.type=instrument inputs.1.level=30 outputs.2.mute=off
+#   $ sudo ./take_control.py dump
+#   $ sudo ./take_control.py fade 2 outputs.2.level=-40
+#   $ sudo ./take_control.py watch outputs.1.level outputs.2.level
+#   $ sudo ./take_control.py save vocals
+#   $ sudo ./take_control.py recall vocals
+# With more than one Apogee Duet connected, devices lists them and --device chooses one:
+#   $ sudo ./take_control.py devices
+#   $ sudo ./take_control.py --device 1:7 get outputs.2.level
+# With take_control_daemon.py running, --socket uses its device instead, without sudo:
+#   $ ./take_control.py --socket /tmp/take_control.sock get outputs.2.level
+# --trace records every transfer done, see take_control_trace.py:
+#   $ sudo ./take_control.py --trace session.trace fade 2 outputs.2.level=-40
+
+import argparse
+import json
+import sys
+import threading
+from enum import Enum
+
+from apogee_duet import ApogeeDuet, PresetStore, PyUsbTransport, SimulatedDuet, State, TracingTransport
+
+_STATE_WORDS = {
+  'on': State.ENABLED,
+  'off': State.DISABLED,
+  'true': State.ENABLED,
+  'false': State.DISABLED,
+  '1': State.ENABLED,
+  '0': State.DISABLED,
+}
+
+class CommandError(Exception):
+  pass
+
+# Numbers stay numbers for JSON, the rest is formatted like format_value() does
+def json_value(value):
+  if value is None or (isinstance(value, int) and not isinstance(value, Enum)):
+    return value
+  return format_value(value)
+
+def format_value(value):
+  if isinstance(value, State):
+    return 'on' if value == State.ENABLED else 'off'
+  if isinstance(value, Enum):
+    return value.name.lower()
+  return str(value)
+
+# Enums can be written with their name, how the GUI shows them or their number
+def parse_value(parameter, text):
+  type_ = parameter.type
+  word = text.strip().lower()
+  try:
+    if type_ is State:
+      return _STATE_WORDS[word]
+    if issubclass(type_, Enum):
+      for member in type_:
+        if word in (member.name.lower(), str(member).lower(), str(member.value)):
+          return member
+      raise KeyError(word)
+    return type_(word)
+  except (KeyError, ValueError):
+    raise CommandError('Invalid value for {}: {}'.format(parameter.path, text))
+
+def find_parameter(parameters, path):
+  try:
+    return parameters[path]
+  except KeyError:
+    raise CommandError('Unknown parameter {}, run dump to see them all'.format(path))
+
+def read(parameter):
+  try:
+    return getattr(parameter.target, parameter.attribute)
+  except ValueError:
+    # Like the level of an input that is neither a microphone nor an instrument
+    return None
+
+def command_get(device, args):
+  parameters = device.parameters()
+  for path in args.parameters:
+    value = read(find_parameter(parameters, path))
+    print(format_value(value) if value is not None else '-')
+
+# The [path, text] of each parameter=value
+def split_assignments(texts):
+  assignments = []
+  for assignment in texts:
+    path, separator, text = assignment.partition('=')
+    if not separator:
+      raise CommandError('Expected parameter=value, not {}'.format(assignment))
+    assignments.append([path, text])
+  return assignments
+
+# The (Parameter, value) of each parameter=value, everything is checked before writing anything
+def parse_assignments(device, texts):
+  parameters = device.parameters()
+  assignments = []
+  for path, text in split_assignments(texts):
+    parameter = find_parameter(parameters, path)
+    assignments.append((parameter, parse_value(parameter, text)))
+  return assignments
+
+def command_set(device, args):
+  assignments = parse_assignments(device, args.assignments)
+  # In the given order, so for example an input type goes before the level, and all in one go
+  try:
+    with device.batch():
+      for parameter, value in assignments:
+        setattr(parameter.target, parameter.attribute, value)
+  except ValueError as e:
+    raise CommandError(str(e))
+  device.flush()
+
+def command_fade(device, args):
+  assignments = parse_assignments(device, args.assignments)
+  ramps = []
+  # All of them at the same time
+  for parameter, value in assignments:
+    try:
+      ramps.append(device.ramp(parameter.target, parameter.attribute, value, args.duration))
+    except ValueError as e:
+      raise CommandError(str(e))
+  for ramp in ramps:
+    ramp.wait()
+  device.flush()
+
+def command_dump(device, args):
+  device.refresh()
+  values = {path: read(parameter) for path, parameter in device.parameters().items()}
+  if args.json:
+    json.dump({path: json_value(value) for path, value in values.items()}, sys.stdout, indent=2)
+    print()
+    return
+  for path, value in values.items():
+    print('{}={}'.format(path, '-' if value is None else format_value(value)))
+
+def command_watch(device, args):
+  parameters = device.parameters()
+  watched = [find_parameter(parameters, path) for path in args.parameters] if args.parameters else parameters.values()
+  # By register name and wIndex, that don't change with the input type like the bRequest of the input level
+  by_register = {}
+  for parameter in watched:
+    key = (parameter.target._registers[parameter.attribute], device.index_of(parameter.target, parameter.attribute))
+    by_register.setdefault(key, []).append(parameter.path)
+  def on_change(change):
+    for path in by_register.get((change.name, change.wIndex), ()):
+      print('{}={}'.format(path, format_value(change.new)), flush=True)
+  device.subscribe(on_change)
+  device.start_polling(fast_interval=args.fast_interval, slow_interval=args.slow_interval)
+  try:
+    threading.Event().wait()
+  except KeyboardInterrupt:
+    pass
+
+def command_save(device, args):
+  try:
+    PresetStore(args.presets).save(device.save_preset(args.name))
+  except ValueError as e:
+    raise CommandError(str(e))
+
+def command_recall(device, args):
+  try:
+    preset = PresetStore(args.presets).load(args.name)
+  except ValueError as e:
+    raise CommandError(str(e))
+  device.recall_preset(preset)
+  device.flush()
+
+def command_presets(device, args):
+  for name in PresetStore(args.presets).names():
+    print(name)
+
+def command_devices(device, args):
+  for transport in PyUsbTransport.find_all(ApogeeDuet.idVendor, ApogeeDuet.idProduct):
+    print(transport.id)
+    transport.close()
+
+# The same commands done by take_control_daemon, which answers with the values already like json_value() does
+
+def remote_get(client, args):
+  for value in client.call('get', paths=args.parameters):
+    print('-' if value is None else value)
+
+def remote_set(client, args):
+  client.call('set', values=split_assignments(args.assignments))
+
+def remote_fade(client, args):
+  client.call('fade', values=split_assignments(args.assignments), duration=args.duration)
+
+def remote_dump(client, args):
+  values = client.call('dump', refresh=True)
+  if args.json:
+    json.dump(values, sys.stdout, indent=2)
+    print()
+    return
+  for path, value in values.items():
+    print('{}={}'.format(path, '-' if value is None else value))
+
+def remote_watch(client, args):
+  client.on_change = lambda path, value: print('{}={}'.format(path, value), flush=True)
+  client.call('subscribe', paths=args.parameters)
+  try:
+    threading.Event().wait()
+  except KeyboardInterrupt:
+    pass
+
+def remote_save(client, args):
+  client.call('save', name=args.name)
+
+def remote_recall(client, args):
+  client.call('recall', name=args.name)
+
+def remote_presets(client, args):
+  for name in client.call('presets'):
+    print(name)
+
+def run_remote(args):
+  from take_control_daemon import DaemonClient, DaemonError
+  remote = getattr(args, 'remote', None)
+  if remote is None:
+    args.function(None, args)
+    return 0
+  try:
+    client = DaemonClient(args.socket)
+  except DaemonError as e:
+    print(e, file=sys.stderr)
+    return 1
+  try:
+    remote(client, args)
+    if args.stats:
+      print(client.call('stats'), file=sys.stderr)
+  except (CommandError, DaemonError) as e:
+    print(e, file=sys.stderr)
+    return 1
+  finally:
+    client.close()
+  return 0
+
+def print_stats(device):
+  print(device.stats_summary(), file=sys.stderr)
+  for (direction, bRequest, wIndex), stat in device.stats().items():
+    print('{:<24} {:<5} {:>3}/{} calls {:>5} transfers {:>5} errors {:>3} mean {:7.3f} ms p99 {:7.3f} ms max {:7.3f} ms'.format(
+      stat.name, direction, bRequest, wIndex, stat.calls, stat.transfers, stat.errors,
+      stat.mean * 1000, stat.p99 * 1000, stat.max * 1000), file=sys.stderr)
+
+def parse_arguments(argv):
+  parser = argparse.ArgumentParser(prog='take_control.py', description='Control the Apogee Duet from the command line')
+  parser.add_argument('--device', metavar='ID', help='Serial number or bus:address of the Apogee Duet to use, see devices')
+  parser.add_argument('--simulate', action='store_true', help='Use a simulated Apogee Duet instead of the real one')
+  parser.add_argument('--stats', action='store_true', help='Print the transfers done with the device and how long they took')
+  parser.add_argument('--presets', help='Directory of the presets, by default ~/.config/take_control/presets')
+  parser.add_argument('--socket', help='Use the Apogee Duet of take_control_daemon.py at this socket instead of opening it')
+  parser.add_argument('--trace', metavar='FILE', help='Record every transfer with the device in FILE, see take_control_trace.py')
+  commands = parser.add_subparsers(dest='command', required=True)
+  command = commands.add_parser('get', help='Print the value of parameters')
+  command.add_argument('parameters', nargs='+', metavar='parameter')
+  command.set_defaults(function=command_get, remote=remote_get)
+  command = commands.add_parser('set', help='Change parameters, in the given order')
+  command.add_argument('assignments', nargs='+', metavar='parameter=value')
+  command.set_defaults(function=command_set, remote=remote_set)
+  command = commands.add_parser('fade', help='Take levels or pan to a value in the given seconds')
+  command.add_argument('duration', type=float, metavar='seconds')
+  command.add_argument('assignments', nargs='+', metavar='parameter=value')
+  command.set_defaults(function=command_fade, remote=remote_fade)
+  command = commands.add_parser('dump', help='Print every parameter')
+  command.add_argument('--json', action='store_true')
+  command.set_defaults(function=command_dump, remote=remote_dump)
+  command = commands.add_parser('watch', help='Print the parameters when they change, until Ctrl+C')
+  command.add_argument('parameters', nargs='*', metavar='parameter')
+  command.add_argument('--fast-interval', type=float, default=0.1)
+  command.add_argument('--slow-interval', type=float, default=1.0)
+  command.set_defaults(function=command_watch, remote=remote_watch)
+  command = commands.add_parser('save', help='Save the state of the device as a preset')
+  command.add_argument('name')
+  command.set_defaults(function=command_save, remote=remote_save)
+  command = commands.add_parser('recall', help='Change only the parameters that are different in a preset')
+  command.add_argument('name')
+  command.set_defaults(function=command_recall, remote=remote_recall)
+  command = commands.add_parser('presets', help='List the saved presets')
+  command.set_defaults(function=command_presets, remote=remote_presets, open_device=False)
+  command = commands.add_parser('devices', help='List the Apogee Duets connected')
+  command.set_defaults(function=command_devices, open_device=False)
+  return parser.parse_args(argv)
+
+def main(argv):
+  args = parse_arguments(argv)
+  if args.socket is not None:
+    return run_remote(args)
+  if not getattr(args, 'open_device', True):
+    args.function(None, args)
+    return 0
+  try:
+    if args.simulate:
+      transport = SimulatedDuet()
+    else:
+      transport = PyUsbTransport.find(ApogeeDuet.idVendor, ApogeeDuet.idProduct, args.device)
+    if args.trace is not None:
+      transport = TracingTransport(transport, args.trace)
+    device = ApogeeDuet(transport=transport, preload=False)
+  except ValueError as e:
+    print(e, file=sys.stderr)
+    return 1
+  try:
+    args.function(device, args)
+  except CommandError as e:
+    print(e, file=sys.stderr)
+    return 1
+  finally:
+    device.close()
+    if args.stats:
+      print_stats(device)
+  return 0
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+
+# Keeps the Apogee Duet open and serves it on a Unix socket. The tools using it don't open the device or read its
+# state every time, and only the daemon needs sudo. The socket can be given to a group of users:
+#   $ sudo ./take_control_daemon.py --group audio
+#   $ ./take_control.py --socket /tmp/take_control.sock get outputs.2.level
+#
+# The protocol is one JSON object per line. A request is {"id": 1, "method": "get", "params": {"paths": ["outputs.2.level"]}}
+# and its response {"id": 1, "result": [-20]} or {"id": 1, "error": "..."}. Requests can be sent without waiting for
+# the responses, they're answered in order. After subscribe the changes arrive as {"method": "change", "params": {...}}
+
+import argparse
+import grp
+import itertools
+import json
+import logging
+import os
+import queue
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from concurrent.futures import Future
+
+from apogee_duet import ApogeeDuet, PresetStore, PyUsbTransport, SimulatedDuet, TracingTransport
+from take_control_cli import CommandError, find_parameter, json_value, parse_value
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = os.path.join(os.environ.get('XDG_RUNTIME_DIR', '/tmp'), 'take_control.sock')
+
+# An error answered by the daemon
+class DaemonError(Exception):
+  pass
+
+class _Connection(socketserver.StreamRequestHandler):
+  # Everything sent to the client goes through a queue written by its own thread, the device callbacks never wait
+  # for a client. A subscriber with more than queue_size messages waiting isn't reading them, it's disconnected
+  queue_size = 1024
+  # Seconds the messages still queued when the client is done have to be sent
+  close_timeout = 5.0
+
+  def setup(self):
+    super().setup()
+    self._outbox = queue.Queue(self.queue_size)
+    self._subscription_lock = threading.Lock()
+    self.subscription = None
+    self._sender = threading.Thread(target=self._send_queued, name='take_control daemon sender', daemon=True)
+    self._sender.start()
+
+  def handle(self):
+    for line in self.rfile:
+      if not line.strip():
+        continue
+      id_ = None
+      try:
+        request = json.loads(line)
+        id_ = request.get('id')
+        response = {'id': id_, 'result': self.server.dispatch(self, request['method'], request.get('params') or {})}
+      except (CommandError, ValueError, KeyError, TypeError) as e:
+        response = {'id': id_, 'error': str(e)}
+      except Exception as e:
+        logger.exception('Error answering %r', line)
+        response = {'id': id_, 'error': '{}: {}'.format(type(e).__name__, e)}
+      self.send(response)
+
+  def finish(self):
+    self.subscribe(None)
+    # What's queued is still sent, unless the client doesn't read it
+    try:
+      self._outbox.put(None, timeout=self.close_timeout)
+    except queue.Full:
+      self._shutdown()
+      self._outbox.put(None)
+    self._sender.join(self.close_timeout)
+    if self._sender.is_alive():
+      self._shutdown()
+      self._sender.join()
+    super().finish()
+
+  # Replaces the callback subscribed to the device for this connection, None only unsubscribes it
+  def subscribe(self, callback):
+    with self._subscription_lock:
+      if self.subscription is not None:
+        self.server.device.unsubscribe(self.subscription)
+      self.subscription = callback
+      if callback is not None:
+        self.server.device.subscribe(callback)
+
+  # The responses, it waits when the client is behind, which only holds the thread of this connection
+  def send(self, message):
+    self._outbox.put(message)
+
+  # The changes, called from the thread writing the register or the poller, so it never waits
+  def notify(self, message):
+    try:
+      self._outbox.put_nowait(message)
+    except queue.Full:
+      logger.warning('Client of take_control daemon not reading its changes, disconnecting it')
+      self.subscribe(None)
+      self._shutdown()
+
+  # The reader and the sender end as the socket is closed
+  def _shutdown(self):
+    try:
+      self.connection.shutdown(socket.SHUT_RDWR)
+    except OSError:
+      pass
+
+  def _send_queued(self):
+    connected = True
+    while True:
+      message = self._outbox.get()
+      if message is None:
+        return
+      if not connected:
+        continue
+      try:
+        self.wfile.write(json.dumps(message, separators=(',', ':')).encode() + b'\n')
+        self.wfile.flush()
+      except OSError:
+        # The client is gone, handle() ends by itself. The rest is dropped so nobody waits for the queue
+        connected = False
+
+class DuetServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  # Every connection has its own threads, one answering and one sending, so a slow client doesn't hold the rest.
+  # The methods are the rpc_<method>() ones, params are their keyword arguments
+  daemon_threads = True
+
+  def __init__(self, path, device, presets=None):
+    self.device = device
+    self.parameters = device.parameters()
+    self.presets = PresetStore(presets)
+    super().__init__(path, _Connection)
+
+  def dispatch(self, connection, method, params):
+    function = getattr(self, 'rpc_' + method, None)
+    if function is None:
+      raise ValueError('Unknown method {}'.format(method))
+    return function(connection, **params)
+
+  # values is a list of [path, value], the values can be numbers or the words the command line takes
+  def _assignments(self, values):
+    assignments = []
+    for path, value in values:
+      parameter = find_parameter(self.parameters, path)
+      assignments.append((parameter, parse_value(parameter, str(value))))
+    return assignments
+
+  def _read(self, parameter, fresh=False):
+    try:
+      if fresh:
+        return json_value(getattr(self.device, 'get_' + parameter.target._registers[parameter.attribute])(parameter.target, True))
+      return json_value(getattr(parameter.target, parameter.attribute))
+    except ValueError:
+      # Like the level of an input that is neither a microphone nor an instrument
+      return None
+
+  def rpc_get(self, connection, paths, fresh=False):
+    return [self._read(find_parameter(self.parameters, path), fresh) for path in paths]
+
+  # Written in the given order as a single batch, it answers when they're on the device
+  def rpc_set(self, connection, values):
+    assignments = self._assignments(values)
+    with self.device.batch() as batch:
+      for parameter, value in assignments:
+        setattr(parameter.target, parameter.attribute, value)
+    batch.future.result()
+
+  def rpc_dump(self, connection, refresh=False):
+    if refresh:
+      self.device.refresh()
+    return {path: self._read(parameter) for path, parameter in self.parameters.items()}
+
+  def rpc_fade(self, connection, values, duration, wait=True):
+    ramps = [self.device.ramp(parameter.target, parameter.attribute, value, duration) for parameter, value in self._assignments(values)]
+    if wait:
+      for ramp in ramps:
+        ramp.wait()
+
+  def rpc_save(self, connection, name):
+    self.presets.save(self.device.save_preset(name))
+
+  def rpc_recall(self, connection, name):
+    self.device.recall_preset(self.presets.load(name)).result()
+
+  def rpc_presets(self, connection):
+    return self.presets.names()
+
+  def rpc_stats(self, connection):
+    return self.device.stats_summary()
+
+  # The changes of the given paths, or all of them, are sent to the connection from now on
+  def rpc_subscribe(self, connection, paths=None):
+    watched = [find_parameter(self.parameters, path) for path in paths] if paths else self.parameters.values()
+    # By register name and wIndex, that don't change with the input type like the bRequest of the input level
+    by_register = {}
+    for parameter in watched:
+      key = (parameter.target._registers[parameter.attribute], self.device.index_of(parameter.target, parameter.attribute))
+      by_register.setdefault(key, []).append(parameter.path)
+    def on_change(change):
+      for path in by_register.get((change.name, change.wIndex), ()):
+        connection.notify({'method': 'change', 'params': {'path': path, 'value': json_value(change.new)}})
+    connection.subscribe(on_change)
+
+class DaemonClient(object):
+  # A connection with the daemon. request() sends a request and returns a concurrent.futures.Future with the result,
+  # so many can be sent before the first is answered, call() waits for it.
+  # on_change(path, value) is called from the reader thread with the changes after subscribe
+  def __init__(self, path=DEFAULT_SOCKET, on_change=None):
+    self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+      self._socket.connect(path)
+    except OSError as e:
+      self._socket.close()
+      raise DaemonError('Can\'t connect with take_control daemon at {}: {}'.format(path, e.strerror))
+    self.on_change = on_change
+    self._ids = itertools.count(1)
+    self._pending = {}
+    self._lock = threading.Lock()
+    self._reader = threading.Thread(target=self._read, name='take_control daemon client', daemon=True)
+    self._reader.start()
+
+  def request(self, method, **params):
+    future = Future()
+    with self._lock:
+      id_ = next(self._ids)
+      self._pending[id_] = future
+      try:
+        self._socket.sendall(json.dumps({'id': id_, 'method': method, 'params': params}, separators=(',', ':')).encode() + b'\n')
+      except OSError as e:
+        del self._pending[id_]
+        raise DaemonError('Connection with take_control daemon lost: {}'.format(e.strerror))
+    return future
+
+  def call(self, method, **params):
+    return self.request(method, **params).result()
+
+  def close(self):
+    try:
+      self._socket.shutdown(socket.SHUT_RDWR)
+    except OSError:
+      pass
+    self._socket.close()
+
+  def _read(self):
+    with self._socket.makefile('rb') as lines:
+      try:
+        for line in lines:
+          message = json.loads(line)
+          if 'id' not in message:
+            if message.get('method') == 'change' and self.on_change is not None:
+              self.on_change(message['params']['path'], message['params']['value'])
+            continue
+          with self._lock:
+            future = self._pending.pop(message['id'], None)
+          if future is None:
+            continue
+          if 'error' in message:
+            future.set_exception(DaemonError(message['error']))
+          else:
+            future.set_result(message.get('result'))
+      except (OSError, ValueError):
+        pass
+    # Nothing else will be answered
+    with self._lock:
+      pending, self._pending = self._pending, {}
+    for future in pending.values():
+      future.set_exception(DaemonError('Connection with take_control daemon lost'))
+
+def parse_arguments(argv):
+  parser = argparse.ArgumentParser(prog='take_control_daemon.py', description='Serve the Apogee Duet on a Unix socket')
+  parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Path of the socket, by default {}'.format(DEFAULT_SOCKET))
+  parser.add_argument('--group', help='Group that can use the socket, so its users don\'t need sudo')
+  parser.add_argument('--mode', type=lambda text: int(text, 8), default=0o660, help='Permissions of the socket, 660 by default')
+  parser.add_argument('--device', metavar='ID', help='Serial number or bus:address of the Apogee Duet to use')
+  parser.add_argument('--simulate', action='store_true', help='Use a simulated Apogee Duet instead of the real one')
+  parser.add_argument('--presets', help='Directory of the presets, by default ~/.config/take_control/presets')
+  parser.add_argument('--trace', metavar='FILE', help='Record every transfer with the device in FILE, see take_control_trace.py')
+  parser.add_argument('--verbose', action='store_true')
+  return parser.parse_args(argv)
+
+def main(argv=None):
+  args = parse_arguments(sys.argv[1:] if argv is None else argv)
+  logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format='%(asctime)s %(name)s: %(message)s')
+  try:
+    if args.simulate:
+      transport = SimulatedDuet()
+    else:
+      transport = PyUsbTransport.find(ApogeeDuet.idVendor, ApogeeDuet.idProduct, args.device)
+    if args.trace is not None:
+      transport = TracingTransport(transport, args.trace)
+    device = ApogeeDuet(transport=transport)
+  except ValueError as e:
+    print(e, file=sys.stderr)
+    return 1
+  # A socket left by a daemon that didn't end well
+  if os.path.exists(args.socket):
+    try:
+      DaemonClient(args.socket).close()
+      print('take_control daemon already running at {}'.format(args.socket), file=sys.stderr)
+      device.close()
+      return 1
+    except DaemonError:
+      os.remove(args.socket)
+  server = DuetServer(args.socket, device, args.presets)
+  os.chmod(args.socket, args.mode)
+  if args.group is not None:
+    os.chown(args.socket, -1, grp.getgrnam(args.group).gr_gid)
+  # The cached state is kept up to date with the changes made on the device itself
+  device.start_polling()
+  signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+  logger.info('Serving Apogee Duet at %s', args.socket)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    os.remove(args.socket)
+    device.close()
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,431 @@
+import wx
+from apogee_duet import (
+  ApogeeDuet,
+  CapabilityStore,
+  ChannelType,
+  InputType,
+  OutputSource,
+  OutputType,
+  SoftwareReturnSource,
+  SpeakerOutputType,
+  StateCache,
+)
+
+apogee_device = None
+
+class Bindings(object):
+  # Calls the functions bound to a register when it changes, on the device itself or from here, so only the
+  # controls showing it are updated. They're bound by the name of the register and its wIndex, that way the level
+  # of an input is still bound after its type moves it to another bRequest
+  def __init__(self, device):
+    self._device = device
+    self._bound = {}
+    device.subscribe(self._on_change)
+
+  # update() is called when any of the attributes of target changes
+  def bind(self, target, attributes, update):
+    for attribute in attributes:
+      key = (target._registers[attribute], self._device.index_of(target, attribute))
+      self._bound.setdefault(key, []).append(update)
+
+  def close(self):
+    self._device.unsubscribe(self._on_change)
+
+  # Called from the poller or the thread that wrote the value, the controls are only touched from the GUI one
+  def _on_change(self, change):
+    updates = self._bound.get((change.name, change.wIndex))
+    if updates:
+      wx.CallAfter(self._update, updates)
+
+  @staticmethod
+  def _update(updates):
+    for update in updates:
+      update()
+
+class InputPanel(wx.Panel):
+  def __init__(self, parent, input_, bindings):
+    wx.Panel.__init__(self, parent)
+    
+    self._input = input_
+    
+    csizer = wx.StaticBoxSizer(wx.VERTICAL, self, 'Input {}'.format(self._input.number))
+    c = self._type_choice = wx.Choice(self, choices=InputType.str_list())
+    c.Bind(wx.EVT_CHOICE, self.on_input_type_changed)
+    csizer.Add(c, flag=wx.EXPAND)  
+    c = self._phantom_power_button = wx.ToggleButton(self, label='Phantom Power')
+    c.Bind(wx.EVT_TOGGLEBUTTON, self.on_phantom_power_toggled)
+    csizer.Add(c, flag=wx.EXPAND)
+    c = self._phase_button = wx.ToggleButton(self, label='Phase')
+    c.Bind(wx.EVT_TOGGLEBUTTON, self.on_phase_toggled)
+    csizer.Add(c, flag=wx.EXPAND)
+    c = self._softlimit_button = wx.ToggleButton(self, label='Soft Limit')
+    c.Bind(wx.EVT_TOGGLEBUTTON, self.on_softlimit_toggled)
+    csizer.Add(c, flag=wx.EXPAND)
+    c = self._group_button = wx.ToggleButton(self, label='Group')
+    c.Bind(wx.EVT_TOGGLEBUTTON, self.on_group_toggled)
+    csizer.Add(c, flag=wx.EXPAND)
+    c = self._level_spin = wx.SpinCtrl(self)
+    c.Bind(wx.EVT_SPINCTRL, self.on_input_level_changed)
+    csizer.Add(c, flag=wx.EXPAND)
+    
+    self.SetSizer(csizer)
+    self.refresh()
+
+    # The phantom power and the level depend on the type too. The group is the same register for both inputs,
+    # so the button of the other one follows
+    bindings.bind(self._input, ('type_',), self._show_type)
+    bindings.bind(self._input, ('type_', 'phantom_power_state'), self._show_phantom_power)
+    bindings.bind(self._input, ('phase_state',), self._show_phase)
+    bindings.bind(self._input, ('softlimit_state',), self._show_softlimit)
+    bindings.bind(self._input, ('group_state',), self._show_group)
+    bindings.bind(self._input, ('type_', 'level'), self._show_level)
+
+  # Shows the values the device has now, it doesn't need to read anything from the device
+  def refresh(self):
+    self._show_type()
+    self._show_phantom_power()
+    self._show_phase()
+    self._show_softlimit()
+    self._show_group()
+    self._show_level()
+
+  def _show_type(self):
+    self._type_choice.SetSelection(self._input.type_.value)
+
+  def _show_phantom_power(self):
+    if self._input.type_ != InputType.MICROPHONE:
+      self._phantom_power_button.Disable()
+    else:
+      self._phantom_power_button.Enable()
+      self._phantom_power_button.SetValue(self._input.phantom_power_state)
+
+  def _show_phase(self):
+    self._phase_button.SetValue(self._input.phase_state)
+
+  def _show_softlimit(self):
+    self._softlimit_button.SetValue(self._input.softlimit_state)
+
+  def _show_group(self):
+    self._group_button.SetValue(self._input.group_state)
+
+  def _show_level(self):
+    try:
+      min_level, max_level = self._input.min_level, self._input.max_level
+    except ValueError:
+      # The line types have no level
+      self._level_spin.Disable()
+      return
+    self._level_spin.Enable()
+    self._level_spin.SetRange(min_level, max_level)
+    self._level_spin.SetValue(self._input.level)
+    
+  def on_phantom_power_toggled(self, event):
+    self._input.toggle_phantom_power()
+    
+  def on_phase_toggled(self, event):
+    self._input.toggle_phase()
+    
+  def on_softlimit_toggled(self, event):
+    self._input.toggle_softlimit()
+
+  def on_group_toggled(self, event):
+    self._input.toggle_group()
+    
+  def on_input_type_changed(self, event):
+    self._input.type_ = event.Int
+
+  def on_input_level_changed(self, event):
+    self._input.level = event.Int
+
+class InputsPage(wx.Panel):
+  def __init__(self, parent, bindings):
+    wx.Panel.__init__(self, parent)
+    
+    sizer = wx.BoxSizer(wx.HORIZONTAL)
+    
+    global apogee_device
+    # Everything the panels show in one go, instead of a transfer per control
+    apogee_device.load('inputs')
+    self._panels = []
+    for input_ in apogee_device.inputs:
+      input_panel = InputPanel(self, input_, bindings)
+      sizer.Add(input_panel, flag=wx.EXPAND|wx.ALL, border=10)
+      self._panels.append(input_panel)
+    
+    self.SetSizer(sizer) 
+    
+class OutputPanel(wx.Panel):
+  def __init__(self, parent, output, bindings):
+    wx.Panel.__init__(self, parent)
+
+    self._output = output
+    
+    csizer = wx.StaticBoxSizer(wx.VERTICAL, self, '{}'.format(self._output.type_))
+    c = self._source_choice = wx.Choice(self, choices=OutputSource.str_list())
+    c.Bind(wx.EVT_CHOICE, self.on_source_changed)
+    csizer.Add(c, flag=wx.EXPAND)
+    c = self._mute_button = wx.ToggleButton(self, label='Mute')
+    c.Bind(wx.EVT_TOGGLEBUTTON, self.on_mute_toggled)
+    csizer.Add(c, flag=wx.EXPAND)
+    c = self._dim_button = wx.ToggleButton(self, label='Dim')
+    c.Bind(wx.EVT_TOGGLEBUTTON, self.on_dim_toggled)
+    csizer.Add(c, flag=wx.EXPAND)
+    c = self._mono_button = wx.ToggleButton(self, label='Mono')
+    c.Bind(wx.EVT_TOGGLEBUTTON, self.on_mono_toggled)
+    csizer.Add(c, flag=wx.EXPAND)
+    c = self._level_spin = wx.SpinCtrl(self)
+    c.SetRange(self._output.min_level, self._output.max_level)
+    c.Bind(wx.EVT_SPINCTRL, self.on_output_level_changed)
+    csizer.Add(c, flag=wx.EXPAND)
+    self._speaker_output_type_choice = None
+    if self._output.type_ == OutputType.SPEAKERS:
+      c = self._speaker_output_type_choice = wx.Choice(self, choices=SpeakerOutputType.str_list())
+      c.Bind(wx.EVT_CHOICE, self.on_speaker_output_type_changed)
+      csizer.Add(c, flag=wx.EXPAND)
+    
+    self.SetSizer(csizer)
+    self.refresh()
+
+    bindings.bind(self._output, ('source',), self._show_source)
+    bindings.bind(self._output, ('mute_state',), self._show_mute)
+    bindings.bind(self._output, ('dim_state',), self._show_dim)
+    bindings.bind(self._output, ('mono_state',), self._show_mono)
+    bindings.bind(self._output, ('level',), self._show_level)
+    if self._speaker_output_type_choice is not None:
+      bindings.bind(self._output, ('spekaer_output_type',), self._show_speaker_output_type)
+
+  def refresh(self):
+    self._show_source()
+    self._show_mute()
+    self._show_dim()
+    self._show_mono()
+    self._show_level()
+    if self._speaker_output_type_choice is not None:
+      self._show_speaker_output_type()
+
+  def _show_source(self):
+    self._source_choice.SetSelection(self._output.source.value)
+
+  def _show_mute(self):
+    self._mute_button.SetValue(self._output.mute_state)
+
+  def _show_dim(self):
+    self._dim_button.SetValue(self._output.dim_state)
+
+  def _show_mono(self):
+    self._mono_button.SetValue(self._output.mono_state)
+
+  def _show_level(self):
+    self._level_spin.SetValue(self._output.level)
+
+  def _show_speaker_output_type(self):
+    self._speaker_output_type_choice.SetSelection(self._output.spekaer_output_type.value)
+
+  def on_mute_toggled(self, event):
+    self._output.toggle_mute()
+
+  def on_dim_toggled(self, event):
+    self._output.toggle_dim()
+
+  def on_mono_toggled(self, event):
+    self._output.toggle_mono()
+
+  def on_output_level_changed(self, event):
+    self._output.level = event.Int
+
+  def on_speaker_output_type_changed(self, event):
+    self._output.spekaer_output_type = event.Int
+ 
+  def on_source_changed(self, event):
+    self._output.source = event.Int
+    
+class OutputsPage(wx.Panel):
+  def __init__(self, parent, bindings):
+    wx.Panel.__init__(self, parent)
+       
+    sizer = wx.BoxSizer(wx.HORIZONTAL)
+    
+    global apogee_device
+    apogee_device.load('outputs')
+    self._panels = []
+    for output in apogee_device.outputs:
+      output_panel = OutputPanel(self, output, bindings)
+      sizer.Add(output_panel, flag=wx.EXPAND|wx.ALL, border=10)
+      self._panels.append(output_panel)
+    
+    self.SetSizer(sizer)
+    
+class ChannelPanel(wx.Panel):
+  def __init__(self, parent, channel, bindings):
+    wx.Panel.__init__(self, parent)
+
+    self._channel = channel
+    self._source_choice = None
+    self._pan_spin = None
+    self._mute_button = None
+    self._solo_button = None
+    
+    csizer = wx.StaticBoxSizer(wx.VERTICAL, self, '{}'.format(self._channel.type_))
+    if self._channel.type_ == ChannelType.SOFTWARE_RETURN:
+      c = self._source_choice = wx.Choice(self, choices=SoftwareReturnSource.str_list())
+      c.Bind(wx.EVT_CHOICE, self.on_source_changed)
+      csizer.Add(c, flag=wx.EXPAND)
+    if self._channel.type_ == ChannelType.INPUT:
+      c = self._pan_spin = wx.SpinCtrl(self)
+      c.SetRange(self._channel.min_pan, self._channel.max_pan)
+      c.Bind(wx.EVT_SPINCTRL, self.on_pan_value_changed)
+      csizer.Add(c, flag=wx.EXPAND)
+    if self._channel.type_ != ChannelType.MASTER:
+      c = self._mute_button = wx.ToggleButton(self, label='Mute')
+      c.Bind(wx.EVT_TOGGLEBUTTON, self.on_mute_toggled)
+      csizer.Add(c, flag=wx.EXPAND)
+      c = self._solo_button = wx.ToggleButton(self, label='Solo')
+      c.Bind(wx.EVT_TOGGLEBUTTON, self.on_solo_toggled)
+      csizer.Add(c, flag=wx.EXPAND)
+    c = self._level_spin = wx.SpinCtrl(self)
+    c.SetRange(self._channel.min_level, self._channel.max_level)
+    c.Bind(wx.EVT_SPINCTRL, self.on_channel_level_changed)
+    csizer.Add(c, flag=wx.EXPAND)
+    
+    self.SetSizer(csizer)
+    self.refresh()
+
+    # Only the controls this channel has, the rest of the registers don't exist for it
+    if self._source_choice is not None:
+      bindings.bind(self._channel, ('source',), self._show_source)
+    if self._pan_spin is not None:
+      bindings.bind(self._channel, ('pan',), self._show_pan)
+    if self._mute_button is not None:
+      bindings.bind(self._channel, ('mute_state',), self._show_mute)
+      bindings.bind(self._channel, ('solo_state',), self._show_solo)
+    bindings.bind(self._channel, ('level',), self._show_level)
+
+  def refresh(self):
+    if self._source_choice is not None:
+      self._show_source()
+    if self._pan_spin is not None:
+      self._show_pan()
+    if self._mute_button is not None:
+      self._show_mute()
+      self._show_solo()
+    self._show_level()
+
+  def _show_source(self):
+    self._source_choice.SetSelection(self._channel.source.value)
+
+  def _show_pan(self):
+    self._pan_spin.SetValue(self._channel.pan)
+
+  def _show_mute(self):
+    self._mute_button.SetValue(self._channel.mute_state)
+
+  def _show_solo(self):
+    self._solo_button.SetValue(self._channel.solo_state)
+
+  def _show_level(self):
+    self._level_spin.SetValue(self._channel.level)
+
+  def on_source_changed(self, event):
+    self._channel.source = event.Int
+
+  def on_pan_value_changed(self, event):
+    self._channel.pan = event.Int
+
+  def on_channel_level_changed(self, event):
+    self._channel.level = event.Int
+
+  def on_mute_toggled(self, event):
+    self._channel.toggle_mute()
+
+  def on_solo_toggled(self, event):
+    self._channel.toggle_solo()
+
+class MixerPage(wx.Panel):
+  def __init__(self, parent, bindings):
+    wx.Panel.__init__(self, parent)
+
+    sizer = wx.BoxSizer(wx.HORIZONTAL)
+
+    global apogee_device
+    apogee_device.load('mixer')
+    self._panels = []
+    for channel in apogee_device.mixer_channels:
+      channel_panel = ChannelPanel(self, channel, bindings)
+      sizer.Add(channel_panel, flag=wx.EXPAND|wx.ALL, border=10)
+      self._panels.append(channel_panel)
+
+    self.SetSizer(sizer)
+
+class LazyPage(wx.Panel):
+  # A notebook page that builds its content, page_class(self, bindings), the first time it's shown
+  def __init__(self, parent, page_class, bindings):
+    wx.Panel.__init__(self, parent)
+    self._page_class = page_class
+    self._bindings = bindings
+    self.page = None
+
+  def build(self):
+    if self.page is not None:
+      return
+    self.page = self._page_class(self, self._bindings)
+    sizer = wx.BoxSizer()
+    sizer.Add(self.page, proportion=1, flag=wx.EXPAND)
+    self.SetSizer(sizer)
+    self.Layout()
+
+class MainFrame(wx.Frame):
+  # transport, cache and capabilities are passed to ApogeeDuet, by default it's the device connected by USB
+  # without the cached state
+  def __init__(self, transport=None, cache=None, capabilities=None):
+    wx.Frame.__init__(self, None, title='Take control')
+    
+    try:
+      global apogee_device
+      # Nothing is read until a page needs it, so the window shows up after reading only its first page.
+      # With a cache, after the first time it shows the last known state right away, and it's checked in the background
+      apogee_device = ApogeeDuet(transport=transport, preload=False, cache=cache, capabilities=capabilities)
+      # Keeps the controls up to date with the changes made here and on the device itself
+      self._bindings = Bindings(apogee_device)
+      
+      panel = wx.Panel(self)
+      notebook = self._notebook = wx.Notebook(panel)
+      
+      self._pages = [
+        LazyPage(notebook, InputsPage, self._bindings),
+        LazyPage(notebook, OutputsPage, self._bindings),
+        LazyPage(notebook, MixerPage, self._bindings),
+      ]
+      notebook.AddPage(self._pages[0], 'Inputs')
+      notebook.AddPage(self._pages[1], 'Outputs')
+      notebook.AddPage(self._pages[2], 'Mixer')
+      self._pages[0].build()
+      notebook.Bind(wx.EVT_NOTEBOOK_PAGE_CHANGED, self.on_page_changed)
+      
+      sizer = wx.BoxSizer()
+      sizer.Add(notebook, flag=wx.EXPAND|wx.ALL)
+      panel.SetSizer(sizer)
+
+      # The other pages are read meanwhile, so they don't wait for the device when they're selected
+      apogee_device.load_in_background(('outputs', 'mixer'))
+      # For the changes made with the knob and the touchpads
+      apogee_device.start_polling()
+      self.Bind(wx.EVT_CLOSE, self.on_close)
+    except ValueError as e:
+      st = wx.StaticText(self, label=str(e))
+
+  def on_page_changed(self, event):
+    self._pages[event.GetSelection()].build()
+    event.Skip()
+
+  def on_close(self, event):
+    self._bindings.close()
+    # Writes what's left and saves the state for the next time
+    apogee_device.close()
+    event.Skip()
+    
+    
+
+def run():
+  app = wx.App()
+  MainFrame(cache=StateCache(), capabilities=CapabilityStore()).Show()
+  app.MainLoop()
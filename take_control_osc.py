@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+
+# Controls the Apogee Duet with OSC messages on UDP, for control surfaces (hardware or apps like TouchOSC):
+#   $ sudo ./take_control_osc.py --host 0.0.0.0 --port 9000 --feedback 192.168.1.20:9001
+#
+# Every parameter of ApogeeDuet.parameters() has an address, like /duet/outputs/2/level for outputs.2.level or
+# /duet/mixer/1/mute for mixer.1.mute. The values are in the units of the parameter (a level in dB, a pan from -64
+# to 64), 0 or 1 for the states and the number of an option for the rest. A message without value asks for the
+# current one, and /duet/refresh for all of them.
+# The faders send hundreds of messages per second, only the last value of each address is written, at most rate
+# times per second. The changes are sent back to every client that sent something and to the --feedback ones
+
+import argparse
+import logging
+import math
+import socket
+import struct
+import sys
+import threading
+import time
+from enum import Enum
+
+from apogee_duet import ApogeeDuet, PyUsbTransport, SimulatedDuet, State
+from take_control_cli import CommandError, parse_value
+
+logger = logging.getLogger(__name__)
+
+PREFIX = '/duet/'
+
+#
+# OSC codec, only what control surfaces use: messages and bundles with int32, float32, string,
+# double, int64, true, false and nil arguments
+#
+
+def _osc_string(text):
+  data = text.encode()
+  # Always ended by at least one zero and padded to 4 bytes
+  return data + b'\0' * (4 - len(data) % 4)
+
+def _read_string(data, offset):
+  end = data.index(b'\0', offset)
+  return data[offset:end].decode(), (end + 4) & ~3
+
+def osc_message(address, *args):
+  tags = ','
+  payload = []
+  for arg in args:
+    if arg is None:
+      tags += 'N'
+    elif isinstance(arg, bool):
+      tags += 'T' if arg else 'F'
+    elif isinstance(arg, int):
+      tags += 'i'
+      payload.append(struct.pack('>i', arg))
+    elif isinstance(arg, float):
+      tags += 'f'
+      payload.append(struct.pack('>f', arg))
+    else:
+      tags += 's'
+      payload.append(_osc_string(str(arg)))
+  return _osc_string(address) + _osc_string(tags) + b''.join(payload)
+
+_ARGUMENTS = {
+  'i': struct.Struct('>i'),
+  'f': struct.Struct('>f'),
+  'd': struct.Struct('>d'),
+  'h': struct.Struct('>q'),
+}
+_CONSTANTS = {'T': True, 'F': False, 'N': None}
+
+def parse_message(data):
+  address, offset = _read_string(data, 0)
+  if offset >= len(data):
+    # Very old clients don't send the type tags
+    return address, []
+  tags, offset = _read_string(data, offset)
+  if not tags.startswith(','):
+    raise ValueError('Invalid OSC type tags {!r}'.format(tags))
+  args = []
+  for tag in tags[1:]:
+    if tag in _ARGUMENTS:
+      argument = _ARGUMENTS[tag]
+      args.append(argument.unpack_from(data, offset)[0])
+      offset += argument.size
+    elif tag == 's':
+      value, offset = _read_string(data, offset)
+      args.append(value)
+    elif tag in _CONSTANTS:
+      args.append(_CONSTANTS[tag])
+    else:
+      raise ValueError('OSC type {!r} not supported'.format(tag))
+  return address, args
+
+# The (address, args) of every message of a packet, the ones in bundles too. The bundles can be nested as deep
+# as a packet allows, so the (start, end) of the elements left are in a stack instead of recursing
+def parse_packet(data):
+  stack = [(0, len(data))]
+  while stack:
+    start, end = stack.pop()
+    if not data.startswith(b'#bundle\0', start, end):
+      yield parse_message(data[start:end])
+      continue
+    # After the time tag, which is ignored, every element has its size first
+    elements = []
+    offset = start + 16
+    while offset < end:
+      size, = struct.unpack_from('>i', data, offset)
+      offset += 4
+      if size < 0 or offset + size > end:
+        raise ValueError('Invalid OSC bundle element size {}'.format(size))
+      elements.append((offset, offset + size))
+      offset += size
+    stack.extend(reversed(elements))
+
+#
+# Bridge
+#
+
+# The OSC value of a parameter value, numbers for everything
+def osc_value(value):
+  if isinstance(value, Enum):
+    return int(value.value)
+  return value
+
+def parameter_value(parameter, arg):
+  if isinstance(arg, str):
+    return parse_value(parameter, arg)
+  if isinstance(arg, float) and not math.isfinite(arg):
+    raise ValueError('Invalid value for {}: {}'.format(parameter.path, arg))
+  if parameter.type is State:
+    return State(bool(arg))
+  if issubclass(parameter.type, Enum):
+    return parameter.type(int(arg))
+  return int(round(arg))
+
+class OscBridge(object):
+  # Receives OSC messages on (host, port) and writes their values to device. Port 0 uses any free port,
+  # the one used is in bridge.port. feedback has the (host, port) of clients that get the changes without sending anything
+  def __init__(self, device, host='127.0.0.1', port=9000, rate=50, feedback=()):
+    self.device = device
+    self.rate = rate
+    # Messages received, and the ones written to the device after keeping only the last one of each address
+    self.received = 0
+    self.applied = 0
+    self._parameters = {PREFIX + path.replace('.', '/'): parameter for path, parameter in device.parameters().items()}
+    # By register name and wIndex, that don't change with the input type like the bRequest of the input level
+    self._addresses = {}
+    for address, parameter in self._parameters.items():
+      key = (parameter.target._registers[parameter.attribute], device.index_of(parameter.target, parameter.attribute))
+      self._addresses.setdefault(key, []).append(address)
+    self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self._socket.bind((host, port))
+    # So the receiver sees stop() soon
+    self._socket.settimeout(0.2)
+    self.port = self._socket.getsockname()[1]
+    self._clients = dict.fromkeys(feedback)
+    # The last value of each address not written yet, with who sent it
+    self._pending = {}
+    self._changed = threading.Condition()
+    self._stopped = False
+    self._threads = []
+
+  def start(self):
+    self.device.subscribe(self._on_device_change)
+    for target, name in ((self._receive, 'OSC receiver'), (self._apply, 'OSC writer')):
+      thread = threading.Thread(target=target, name=name, daemon=True)
+      thread.start()
+      self._threads.append(thread)
+
+  def stop(self):
+    self.device.unsubscribe(self._on_device_change)
+    with self._changed:
+      self._stopped = True
+      self._changed.notify()
+    for thread in self._threads:
+      thread.join()
+    self._threads = []
+    self._socket.close()
+
+  def send(self, client, address, value):
+    try:
+      self._socket.sendto(osc_message(address, osc_value(value)), client)
+    except OSError as e:
+      logger.debug('Can\'t send %s to %s: %s', address, client, e)
+
+  def _send_to_clients(self, address, value, sender=None):
+    for client in list(self._clients):
+      if client != sender:
+        self.send(client, address, value)
+
+  def _send_current(self, client, addresses):
+    for address in addresses:
+      parameter = self._parameters[address]
+      try:
+        value = getattr(parameter.target, parameter.attribute)
+      except ValueError:
+        # Like the level of an input that is neither a microphone nor an instrument
+        continue
+      self.send(client, address, value)
+
+  def _receive(self):
+    while not self._stopped:
+      try:
+        data, client = self._socket.recvfrom(65536)
+      except socket.timeout:
+        continue
+      self._clients[client] = None
+      try:
+        messages = list(parse_packet(data))
+      except Exception as e:
+        logger.debug('Invalid OSC packet from %s: %s', client, e)
+        continue
+      for address, args in messages:
+        # Nothing a client sends stops the receiver
+        try:
+          self._on_message(client, address, args)
+        except Exception:
+          logger.exception('Error handling OSC message %s from %s', address, client)
+
+  def _on_message(self, client, address, args):
+    self.received += 1
+    if address == PREFIX + 'refresh':
+      self._send_current(client, self._parameters)
+      return
+    if address not in self._parameters:
+      logger.debug('Unknown OSC address %s', address)
+      return
+    if not args or args[0] is None:
+      self._send_current(client, (address,))
+      return
+    with self._changed:
+      self._pending[address] = (args[0], client)
+      self._changed.notify()
+
+  # Writes the pending values at most rate times per second, all the ones of a pass in one batch
+  def _apply(self):
+    interval = 1.0 / self.rate
+    next_pass = time.monotonic()
+    while True:
+      with self._changed:
+        while not self._pending and not self._stopped:
+          self._changed.wait()
+        # More values of the same addresses can arrive meanwhile, only the last ones are written.
+        # Every message wakes it up, so it waits again until it's time
+        delay = next_pass - time.monotonic()
+        while delay > 0 and not self._stopped:
+          self._changed.wait(delay)
+          delay = next_pass - time.monotonic()
+        if self._stopped:
+          return
+        pending, self._pending = self._pending, {}
+      next_pass = max(next_pass + interval, time.monotonic())
+      applied = []
+      with self.device.batch():
+        for address, (arg, client) in pending.items():
+          parameter = self._parameters[address]
+          try:
+            value = parameter_value(parameter, arg)
+            setattr(parameter.target, parameter.attribute, value)
+          except (ValueError, CommandError) as e:
+            logger.debug('Invalid value for %s: %s', address, e)
+            continue
+          applied.append((address, value, client))
+      self.applied += len(applied)
+      for address, value, client in applied:
+        self._send_to_clients(address, value, client)
+
+  # The changes made on the device itself
+  def _on_device_change(self, change):
+    # The values written from here are already sent by _apply()
+    if change.local:
+      return
+    for address in self._addresses.get((change.name, change.wIndex), ()):
+      self._send_to_clients(address, change.new)
+
+def _client(text):
+  host, separator, port = text.rpartition(':')
+  if not separator:
+    raise argparse.ArgumentTypeError('Expected host:port, not {}'.format(text))
+  return (host, int(port))
+
+def parse_arguments(argv):
+  parser = argparse.ArgumentParser(prog='take_control_osc.py', description='Control the Apogee Duet with OSC messages')
+  parser.add_argument('--host', default='127.0.0.1', help='Address to receive the messages on, 0.0.0.0 for all of them')
+  parser.add_argument('--port', type=int, default=9000)
+  parser.add_argument('--rate', type=float, default=50, help='How many times per second the values are written at most')
+  parser.add_argument('--feedback', type=_client, action='append', default=[], metavar='HOST:PORT',
+    help='Client to send the changes to even if it doesn\'t send anything, can be repeated')
+  parser.add_argument('--device', metavar='ID', help='Serial number or bus:address of the Apogee Duet to use')
+  parser.add_argument('--simulate', action='store_true', help='Use a simulated Apogee Duet instead of the real one')
+  parser.add_argument('--verbose', action='store_true')
+  return parser.parse_args(argv)
+
+def main(argv=None):
+  args = parse_arguments(sys.argv[1:] if argv is None else argv)
+  logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING, format='%(asctime)s %(name)s: %(message)s')
+  try:
+    if args.simulate:
+      transport = SimulatedDuet()
+    elif args.device is not None:
+      transport = PyUsbTransport.find(ApogeeDuet.idVendor, ApogeeDuet.idProduct, args.device)
+    else:
+      transport = None
+    device = ApogeeDuet(transport=transport)
+  except ValueError as e:
+    print(e, file=sys.stderr)
+    return 1
+  bridge = OscBridge(device, args.host, args.port, args.rate, args.feedback)
+  bridge.start()
+  # For the changes made with the knob and the touchpads
+  device.start_polling()
+  try:
+    threading.Event().wait()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    bridge.stop()
+    device.close()
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
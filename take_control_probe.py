@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+# Finds out what the Apogee Duet answers: reads every bRequest and wIndex of the given ranges and keeps what each one
+# answered in its capabilities, ~/.cache/take_control/capabilities-<id>.json. ApogeeDuet builds its inputs, outputs
+# and mixer channels from them with capabilities=CapabilityStore(). A scan stopped with Ctrl+C goes on where it
+# was the next time, and every Apogee Duet connected is probed at the same time:
+#   $ sudo ./take_control_probe.py
+#   $ sudo ./take_control_probe.py --requests 0-255 --indexes 0-15 --rate 50
+#   $ sudo ./take_control_probe.py --show
+# Only reads are done, but they're requests nobody knows what they do, so better without anything playing
+
+import argparse
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import usb.util
+
+from apogee_duet import (
+  ApogeeDuet,
+  Capabilities,
+  CapabilityStore,
+  DeviceDisconnected,
+  PyUsbTransport,
+  SimulatedDuet,
+  TransportError,
+  TransportTimeout,
+)
+
+logger = logging.getLogger(__name__)
+
+_READ = usb.util.CTRL_TYPE_VENDOR | usb.util.CTRL_IN | usb.util.CTRL_RECIPIENT_DEVICE
+
+class Prober(object):
+  # Reads every (bRequest, wIndex) of requests and indexes that capabilities doesn't have yet with transport,
+  # at most rate per second, each one waiting timeout ms at most. save(capabilities) is called every
+  # save_interval seconds and at the end, so a stopped scan keeps what it found
+  def __init__(self, transport, capabilities, requests, indexes, rate=100, timeout=100, save=None, save_interval=5.0):
+    self.transport = transport
+    self.capabilities = capabilities
+    self.requests = requests
+    self.indexes = indexes
+    self.rate = rate
+    self.timeout = timeout
+    self._save = save
+    self.save_interval = save_interval
+    # Done in this run
+    self.answered = 0
+    self.stalled = 0
+    self.timeouts = 0
+
+  # Returns True when every one was probed, False when stop was set or the device went away
+  def run(self, stop=None):
+    interval = 1.0 / self.rate
+    deadline = time.monotonic()
+    saved = time.monotonic()
+    try:
+      for bRequest in self.requests:
+        for wIndex in self.indexes:
+          register = (bRequest, wIndex)
+          if self.capabilities.probed(register):
+            continue
+          if stop is not None and stop.is_set():
+            return False
+          delay = deadline - time.monotonic()
+          if delay > 0:
+            time.sleep(delay)
+          deadline = max(deadline + interval, time.monotonic())
+          try:
+            self.capabilities.values[register] = self.transport.ctrl_transfer(_READ, bRequest, 0, wIndex, 1, self.timeout)[0]
+            self.answered += 1
+          except DeviceDisconnected:
+            logger.warning('%s disconnected, the probe goes on from %d/%d the next time', self.transport.id, bRequest, wIndex)
+            return False
+          except TransportTimeout:
+            self.timeouts += 1
+          except TransportError:
+            # A stall, the device doesn't know the request
+            self.capabilities.stalled.add(register)
+            self.stalled += 1
+          if self._save is not None and time.monotonic() - saved > self.save_interval:
+            self._save(self.capabilities)
+            saved = time.monotonic()
+      return True
+    finally:
+      if self._save is not None:
+        self._save(self.capabilities)
+
+def _range(text):
+  first, separator, last = text.partition('-')
+  try:
+    return range(int(first, 0), int(last if separator else first, 0) + 1)
+  except ValueError:
+    raise argparse.ArgumentTypeError('Expected a number or first-last, not {}'.format(text))
+
+def print_capabilities(id_, capabilities):
+  layout = capabilities.layout()
+  print('{}: {} answered, {} stalled'.format(id_, len(capabilities.values), len(capabilities.stalled)))
+  if layout is not None:
+    print('  {} inputs, outputs {}, mixer {}'.format(layout.inputs, ', '.join(str(type_) for type_ in layout.outputs),
+      ', '.join(str(type_) for type_ in layout.mixer)))
+  for bRequest, wIndex in capabilities.unknown():
+    print('  unknown {:>3}/{} = {}'.format(bRequest, wIndex, capabilities.values[bRequest, wIndex]))
+
+def parse_arguments(argv):
+  parser = argparse.ArgumentParser(prog='take_control_probe.py', description='Find out the requests the Apogee Duet answers')
+  parser.add_argument('--requests', type=_range, default=range(256), metavar='FIRST-LAST', help='bRequest range, 0-255 by default')
+  parser.add_argument('--indexes', type=_range, default=range(8), metavar='FIRST-LAST', help='wIndex range, 0-7 by default')
+  parser.add_argument('--rate', type=float, default=100, help='Reads per second at most of every device')
+  parser.add_argument('--timeout', type=int, default=100, help='Milliseconds to wait for every read')
+  parser.add_argument('--device', metavar='ID', action='append', help='Probe only this one, can be repeated')
+  parser.add_argument('--simulate', action='store_true', help='Probe a simulated Apogee Duet instead of the real ones')
+  parser.add_argument('--restart', action='store_true', help='Forget what was found before')
+  parser.add_argument('--show', action='store_true', help='Print what was found before without probing')
+  parser.add_argument('--directory', help='Where the capabilities are, by default ~/.cache/take_control')
+  parser.add_argument('--verbose', action='store_true')
+  return parser.parse_args(argv)
+
+def main(argv=None):
+  args = parse_arguments(sys.argv[1:] if argv is None else argv)
+  logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format='%(asctime)s %(name)s: %(message)s')
+  store = CapabilityStore(args.directory)
+  if args.simulate:
+    transports = [SimulatedDuet()]
+  else:
+    transports = PyUsbTransport.find_all(ApogeeDuet.idVendor, ApogeeDuet.idProduct)
+    if args.device:
+      transports = [transport for transport in transports if transport.id in args.device]
+  if not transports:
+    print('Apogee Duet not found', file=sys.stderr)
+    return 1
+  if args.show:
+    for transport in transports:
+      print_capabilities(transport.id, store.load(transport.id))
+      transport.close()
+    return 0
+  probers = []
+  for transport in transports:
+    capabilities = Capabilities() if args.restart else store.load(transport.id)
+    probers.append(Prober(transport, capabilities, args.requests, args.indexes, args.rate, args.timeout,
+      lambda capabilities, id_=transport.id: store.save(id_, capabilities)))
+  stop = threading.Event()
+  # Each device with its own thread, a slow one doesn't hold the others
+  with ThreadPoolExecutor(max_workers=len(probers)) as executor:
+    futures = [executor.submit(prober.run, stop) for prober in probers]
+    try:
+      finished = [future.result() for future in futures]
+    except KeyboardInterrupt:
+      stop.set()
+      finished = [future.result() for future in futures]
+  for prober, done in zip(probers, finished):
+    print_capabilities(prober.transport.id, prober.capabilities)
+    print('  {} answered, {} stalled and {} timed out in this run{}'.format(prober.answered, prober.stalled,
+      prober.timeouts, '' if done else ', not finished'))
+    prober.transport.close()
+  return 0 if all(finished) else 1
+
+if __name__ == '__main__':
+  sys.exit(main())
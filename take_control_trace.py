@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+# Reads and replays the traces of TracingTransport, every control transfer done with the Apogee Duet.
+# A session is recorded with --trace, and replayed against a simulated Apogee Duet as it happened or as fast
+# as possible, to compare the performance of two versions with the same load or to find out new registers:
+#   $ sudo ./take_control.py --trace session.trace fade 2 outputs.2.level=-40
+#   $ ./take_control_trace.py show session.trace
+#   $ ./take_control_trace.py stats session.trace
+#   $ ./take_control_trace.py replay --max session.trace
+
+import argparse
+import json
+import mmap
+import sys
+import time
+from collections import Counter, namedtuple
+
+import usb.util
+
+from apogee_duet import (
+  TRACE_ERROR,
+  TRACE_HEADER,
+  TRACE_MAGIC,
+  TRACE_RECORD,
+  SimulatedDuet,
+  TransportError,
+  _REGISTERS_BY_REQUEST,
+)
+
+TraceRecord = namedtuple('TraceRecord', 'time bmRequestType bRequest wIndex value flags')
+
+class Trace(object):
+  # A trace file mapped in memory, the records are unpacked from it when they're used without copying the file.
+  # started is the time.time() the trace started
+  def __init__(self, path):
+    self._file = open(path, 'rb')
+    try:
+      self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+      # An empty file can't be mapped
+      self._file.close()
+      raise ValueError('{} is not a trace'.format(path))
+    if len(self._map) < TRACE_HEADER.size or TRACE_HEADER.unpack_from(self._map)[0] != TRACE_MAGIC:
+      self.close()
+      raise ValueError('{} is not a trace'.format(path))
+    self.started = TRACE_HEADER.unpack_from(self._map)[1]
+    # A record cut by a crash is left out
+    self._count = (len(self._map) - TRACE_HEADER.size) // TRACE_RECORD.size
+    self._records = memoryview(self._map)[TRACE_HEADER.size:TRACE_HEADER.size + self._count * TRACE_RECORD.size]
+
+  def __len__(self):
+    return self._count
+
+  def __getitem__(self, index):
+    if index < 0:
+      index += self._count
+    if not 0 <= index < self._count:
+      raise IndexError('trace record out of range')
+    return TraceRecord._make(TRACE_RECORD.unpack_from(self._records, index * TRACE_RECORD.size))
+
+  def __iter__(self):
+    return map(TraceRecord._make, TRACE_RECORD.iter_unpack(self._records))
+
+  # How long the trace lasted, in seconds
+  @property
+  def duration(self):
+    return self[-1].time if self._count else 0.0
+
+  def close(self):
+    if getattr(self, '_records', None) is not None:
+      self._records.release()
+      self._records = None
+    self._map.close()
+    self._file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+def is_read(record):
+  return bool(record.bmRequestType & usb.util.CTRL_IN)
+
+def register_name(record):
+  register = _REGISTERS_BY_REQUEST.get(record.bRequest)
+  return register.name if register is not None else '?'
+
+# What the device had before the trace: the first value read of every register that wasn't written before
+def initial_registers(trace):
+  registers = {}
+  written = set()
+  for record in trace:
+    if record.flags & TRACE_ERROR:
+      continue
+    register = (record.bRequest, record.wIndex)
+    if not is_read(record):
+      written.add(register)
+    elif register not in written:
+      registers.setdefault(register, record.value)
+  return registers
+
+# mismatches are the reads that got another value than in the trace
+ReplayResult = namedtuple('ReplayResult', 'transfers reads writes errors mismatches elapsed')
+
+# Does the transfers of trace with transport, speed times faster than they were done or as fast as possible with
+# speed None. The transfers that failed in the trace are done too, the ones failing now are counted in errors
+def replay(trace, transport, speed=1.0):
+  reads = writes = errors = mismatches = 0
+  start = time.perf_counter()
+  for record in trace:
+    if speed:
+      delay = start + record.time / speed - time.perf_counter()
+      if delay > 0:
+        time.sleep(delay)
+    try:
+      if is_read(record):
+        reads += 1
+        value = transport.ctrl_transfer(record.bmRequestType, record.bRequest, 0, record.wIndex, 1)[0]
+        if not record.flags & TRACE_ERROR and value != record.value:
+          mismatches += 1
+      else:
+        writes += 1
+        transport.ctrl_transfer(record.bmRequestType, record.bRequest, 0, record.wIndex, [record.value])
+    except TransportError:
+      errors += 1
+  return ReplayResult(reads + writes, reads, writes, errors, mismatches, time.perf_counter() - start)
+
+def command_show(trace, args):
+  for record in trace:
+    print('{:10.6f} {:<5} {:<24} {:>3}/{} = {:>3}{}'.format(
+      record.time, 'read' if is_read(record) else 'write', register_name(record), record.bRequest, record.wIndex,
+      record.value, ' failed' if record.flags & TRACE_ERROR else ''))
+
+def command_stats(trace, args):
+  counts = Counter()
+  errors = 0
+  for record in trace:
+    counts['read' if is_read(record) else 'write', record.bRequest, record.wIndex] += 1
+    errors += bool(record.flags & TRACE_ERROR)
+  duration = trace.duration
+  print('{} transfers in {:.3f} s ({:.1f}/s), {} failed, started {}'.format(len(trace), duration,
+    len(trace) / duration if duration else 0.0, errors, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(trace.started))))
+  for (direction, bRequest, wIndex), count in counts.most_common():
+    name = register_name(TraceRecord(0, 0, bRequest, wIndex, 0, 0))
+    print('{:<5} {:<24} {:>3}/{} {:>7}'.format(direction, name, bRequest, wIndex, count))
+
+def command_replay(trace, args):
+  # The simulated device starts as the real one was, so the reads can be compared
+  transport = SimulatedDuet(initial_registers(trace), latency=args.latency, jitter=args.jitter, seed=0)
+  result = replay(trace, transport, None if args.max else args.speed)
+  json.dump(dict(result._asdict(), rate=result.transfers / result.elapsed if result.elapsed else 0.0), sys.stdout, indent=2)
+  print()
+  return 1 if result.mismatches and args.strict else 0
+
+def parse_arguments(argv):
+  parser = argparse.ArgumentParser(prog='take_control_trace.py', description='Read and replay traces of the Apogee Duet')
+  commands = parser.add_subparsers(dest='command', required=True)
+  command = commands.add_parser('show', help='Print every transfer')
+  command.add_argument('trace')
+  command.set_defaults(function=command_show)
+  command = commands.add_parser('stats', help='Print how many transfers were done with every register')
+  command.add_argument('trace')
+  command.set_defaults(function=command_stats)
+  command = commands.add_parser('replay', help='Do the transfers again with a simulated Apogee Duet, prints the results as JSON')
+  command.add_argument('trace')
+  command.add_argument('--speed', type=float, default=1.0, help='How many times faster than they were done')
+  command.add_argument('--max', action='store_true', help='As fast as possible')
+  command.add_argument('--latency', type=float, default=0.0005, help='Seconds every simulated transfer takes')
+  command.add_argument('--jitter', type=float, default=0.0)
+  command.add_argument('--strict', action='store_true', help='Fail when a read gets another value than in the trace')
+  command.set_defaults(function=command_replay)
+  return parser.parse_args(argv)
+
+def main(argv=None):
+  args = parse_arguments(sys.argv[1:] if argv is None else argv)
+  try:
+    trace = Trace(args.trace)
+  except (OSError, ValueError) as e:
+    print(e, file=sys.stderr)
+    return 1
+  with trace:
+    return args.function(trace, args) or 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,454 @@
+# Tests of the device model against SimulatedDuet, they don't need the hardware or wx:
+#   $ python -m unittest
+# or with pytest
+
+import asyncio
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+import usb.util
+
+from apogee_duet import (
+  DUET_LAYOUT,
+  ApogeeDuet,
+  AsyncApogeeDuet,
+  Capabilities,
+  CapabilityStore,
+  ChannelType,
+  DeviceDisconnected,
+  DuetManager,
+  InputType,
+  Layout,
+  OutputType,
+  Preset,
+  PresetStore,
+  SimulatedDuet,
+  SoftwareReturnSource,
+  State,
+  StateCache,
+  TransferStats,
+  TransportError,
+  _REGISTER_MAP,
+  _layout_registers,
+)
+from take_control_cli import CommandError, command_save
+from take_control_probe import Prober
+
+# A SimulatedDuet that keeps every (bRequest, wIndex, value) written, in order
+class RecordingDuet(SimulatedDuet):
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.written = []
+
+  def ctrl_transfer(self, bmRequestType, bRequest, wValue=0, wIndex=0, data_or_wLength=None, timeout=None):
+    result = super().ctrl_transfer(bmRequestType, bRequest, wValue, wIndex, data_or_wLength, timeout)
+    if not bmRequestType & usb.util.CTRL_IN:
+      self.written.append((bRequest, wIndex, data_or_wLength[0]))
+    return result
+
+class DeviceTestCase(unittest.TestCase):
+  def open(self, transport=None, **kwargs):
+    self.transport = transport if transport is not None else RecordingDuet()
+    device = ApogeeDuet(transport=self.transport, **kwargs)
+    self.addCleanup(device.close)
+    return device
+
+  def register(self, device, target, attribute):
+    return self.transport.registers[device.register_of(target, attribute)]
+
+class TransportTest(DeviceTestCase):
+  def test_simulated_duet_defaults(self):
+    device = self.open()
+    self.assertEqual([output.level for output in device.outputs], [-20, -20])
+    self.assertEqual(device.inputs[0].type_, InputType.MICROPHONE)
+    device.outputs[0].level = -30
+    device.flush()
+    self.assertEqual(self.register(device, device.outputs[0], 'level'), 30)
+    self.assertEqual(self.transport.written, [(51, 0, 30)])
+
+  def test_unknown_register_stalls(self):
+    transport = SimulatedDuet()
+    transport.reconnect()
+    with self.assertRaises(TransportError):
+      transport.ctrl_transfer(ApogeeDuet._READ, 200, 0, 0, 1)
+
+  def test_failures_and_unplug(self):
+    transport = SimulatedDuet()
+    transport.reconnect()
+    transport.fail_next()
+    with self.assertRaises(TransportError):
+      transport.ctrl_transfer(ApogeeDuet._READ, 51, 0, 0, 1)
+    self.assertEqual(list(transport.ctrl_transfer(ApogeeDuet._READ, 51, 0, 0, 1)), [20])
+    transport.unplug()
+    with self.assertRaises(DeviceDisconnected):
+      transport.ctrl_transfer(ApogeeDuet._READ, 51, 0, 0, 1)
+    # A new device for the USB stack, until it's opened again
+    transport.plug()
+    with self.assertRaises(DeviceDisconnected):
+      transport.ctrl_transfer(ApogeeDuet._READ, 51, 0, 0, 1)
+    transport.reconnect()
+    self.assertEqual(list(transport.ctrl_transfer(ApogeeDuet._READ, 51, 0, 0, 1)), [20])
+
+class CoalescingTest(DeviceTestCase):
+  def test_only_the_last_value_is_written(self):
+    device = self.open(max_write_rate=5)
+    headphones = device.outputs[1]
+    writes = self.transport.writes
+    for level in range(-60, -9):
+      headphones.level = level
+    # The getters see the value waiting to be written
+    self.assertEqual(headphones.level, -10)
+    device.flush()
+    self.assertEqual(self.register(device, headphones, 'level'), 10)
+    self.assertLessEqual(self.transport.writes - writes, 2)
+
+  def test_flush_writes_every_register(self):
+    device = self.open(max_write_rate=1)
+    device.outputs[0].level = -30
+    device.mixer_channels[0].pan = 20
+    device.flush()
+    self.assertEqual(device.get_output_level(device.outputs[0], fresh=True), -30)
+    self.assertEqual(device.get_pan_value(device.mixer_channels[0], fresh=True), 20)
+
+class BatchTest(DeviceTestCase):
+  def test_repeated_registers_are_written_once(self):
+    device = self.open()
+    input_ = device.inputs[0]
+    with device.batch() as batch:
+      input_.type_ = InputType.INSTRUMENT
+      input_.level = 20
+      input_.level = 25
+      device.outputs[1].level = -30
+      # Back to the value it has, nothing to write
+      device.outputs[1].level = -20
+    batch.future.result()
+    level = device.register_of(input_, 'level')
+    self.assertEqual(self.transport.written, [(22, 0, InputType.INSTRUMENT.value), level + (25,)])
+    self.assertEqual(device.get_input_level(input_, fresh=True), 25)
+
+  def test_inputs_grouped_again_after_the_type(self):
+    device = self.open(RecordingDuet({(68, 0): 1, (68, 1): 1}))
+    with device.batch() as batch:
+      device.inputs[0].type_ = InputType.INSTRUMENT
+      device.inputs[0].group_state = State.ENABLED
+    batch.future.result()
+    self.assertEqual(self.transport.written, [(68, 0, 0), (68, 1, 0), (22, 0, InputType.INSTRUMENT.value), (68, 0, 1), (68, 1, 1)])
+
+  def test_failed_batch_is_rolled_back(self):
+    device = self.open()
+    changes = []
+    device.subscribe(changes.append)
+    self.transport.fail_next()
+    with device.batch() as batch:
+      device.outputs[0].level = -50
+      device.outputs[1].level = -10
+    with self.assertRaises(TransportError):
+      batch.future.result()
+    self.assertEqual([output.level for output in device.outputs], [-20, -20])
+    self.assertEqual(self.transport.registers[51, 0], 20)
+    self.assertEqual(self.transport.registers[51, 1], 20)
+    # The subscribers are told about the values that are back
+    self.assertEqual(changes[-1].new, -20)
+    self.assertTrue(changes[-1].local)
+
+  def test_failed_type_keeps_what_the_device_has(self):
+    class FailingType(RecordingDuet):
+      def ctrl_transfer(self, bmRequestType, bRequest, wValue=0, wIndex=0, data_or_wLength=None, timeout=None):
+        if bRequest == 22 and not bmRequestType & usb.util.CTRL_IN:
+          raise TransportError('Simulated transfer error')
+        return super().ctrl_transfer(bmRequestType, bRequest, wValue, wIndex, data_or_wLength, timeout)
+    device = self.open(FailingType({(68, 0): 1, (68, 1): 1}))
+    with device.batch() as batch:
+      device.inputs[0].type_ = InputType.INSTRUMENT
+      device.inputs[0].group_state = State.ENABLED
+    with self.assertRaises(TransportError):
+      batch.future.result()
+    # Ungrouped before the type failed
+    self.assertEqual(self.transport.written, [(68, 0, 0), (68, 1, 0)])
+    self.assertEqual((device.inputs[0].type_, device.inputs[0].group_state), (InputType.MICROPHONE, State.DISABLED))
+
+  def test_exception_in_batch_writes_nothing(self):
+    device = self.open()
+    with self.assertRaises(RuntimeError):
+      with device.batch():
+        device.outputs[0].level = -50
+        raise RuntimeError()
+    self.assertEqual(device.outputs[0].level, -20)
+    self.assertEqual(self.transport.written, [])
+
+class StatsTest(DeviceTestCase):
+  def test_counts_and_percentiles(self):
+    stats = TransferStats()
+    for i in range(98):
+      stats.transfer(TransferStats.READ, (51, 0), 3e-6)
+    stats.transfer(TransferStats.READ, (51, 0), 1e-3)
+    stats.transfer(TransferStats.READ, (51, 0), 1e-3, error=True)
+    stat = stats.snapshot()[TransferStats.READ, 51, 0]
+    self.assertEqual((stat.name, stat.transfers, stat.errors), ('output_level', 100, 1))
+    self.assertAlmostEqual(stat.mean, (98 * 3e-6 + 2e-3) / 100)
+    self.assertEqual(stat.max, 1e-3)
+    # Upper bounds of the buckets, powers of two microseconds
+    self.assertEqual(stat.p50, 4e-6)
+    self.assertEqual(stat.p99, 1024e-6)
+    self.assertEqual(stat.histogram, ((4e-6, 98), (1024e-6, 2)))
+
+  def test_device_counts_calls_and_transfers(self):
+    device = self.open()
+    device.reset_stats()
+    for level in (-40, -35, -30):
+      device.set_output_level(device.outputs[0], level).result()
+    # From the shadow registers, without transfers
+    for i in range(3):
+      device.outputs[1].level
+    self.transport.fail_next()
+    with self.assertRaises(TransportError):
+      device.get_output_level(device.outputs[1], fresh=True)
+    stats = device.stats()
+    write = stats[TransferStats.WRITE, 51, 0]
+    self.assertEqual((write.calls, write.transfers, write.errors), (3, 3, 0))
+    read = stats[TransferStats.READ, 51, 1]
+    self.assertEqual((read.calls, read.transfers, read.errors), (4, 1, 1))
+    self.assertTrue(device.stats_summary().startswith('1 reads, 3 writes, 1 errors'))
+
+class PresetTest(DeviceTestCase):
+  def test_recall_ungroups_before_the_type_and_sets_the_type_before_the_level(self):
+    device = self.open()
+    device.inputs[0].type_ = InputType.INSTRUMENT
+    device.inputs[0].level = 30
+    preset = device.save_preset('instrument')
+    device.inputs[0].level = 10
+    device.inputs[0].type_ = InputType.MICROPHONE
+    device.inputs[0].group_state = State.ENABLED
+    device.outputs[0].level = -40
+    device.flush()
+    del self.transport.written[:]
+    device.recall_preset(preset).result()
+    written = [register[:2] for register in self.transport.written]
+    self.assertEqual(written[:2], [(68, 0), (68, 1)])
+    self.assertLess(written.index((22, 0)), written.index((62, 0)))
+    self.assertEqual((device.inputs[0].type_, device.inputs[0].level), (InputType.INSTRUMENT, 30))
+    self.assertEqual(device.outputs[0].level, -20)
+
+  def test_recall_groups_the_inputs_again_after_the_type(self):
+    device = self.open()
+    device.inputs[0].type_ = InputType.INSTRUMENT
+    device.inputs[0].group_state = State.ENABLED
+    preset = device.save_preset('grouped')
+    device.inputs[0].type_ = InputType.MICROPHONE
+    device.inputs[0].group_state = State.ENABLED
+    device.flush()
+    del self.transport.written[:]
+    device.recall_preset(preset).result()
+    self.assertEqual(self.transport.written, [(68, 0, 0), (68, 1, 0), (22, 0, InputType.INSTRUMENT.value), (68, 0, 1), (68, 1, 1)])
+    self.assertEqual((device.inputs[0].type_, device.inputs[0].group_state), (InputType.INSTRUMENT, State.ENABLED))
+
+  def test_only_the_differences_are_written(self):
+    device = self.open()
+    preset = device.save_preset('now')
+    device.recall_preset(preset).result()
+    self.assertEqual(self.transport.written, [])
+    self.assertEqual(Preset.from_json(preset.to_json()).registers, preset.registers)
+
+  def test_invalid_names(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    device = self.open()
+    for name in ('', '../evil', '.hidden'):
+      with self.assertRaises(ValueError):
+        PresetStore(directory.name).save(device.save_preset(name))
+      with self.assertRaises(CommandError):
+        command_save(device, types.SimpleNamespace(presets=directory.name, name=name))
+
+class RampTest(DeviceTestCase):
+  def test_slow_device_skips_steps_and_ends_on_the_value(self):
+    device = self.open(max_write_rate=100)
+    headphones = device.outputs[1]
+    self.transport.latency = 0.03
+    ramp = headphones.fade_to(-60, 0.3)
+    self.assertTrue(ramp.wait(5))
+    self.assertFalse(ramp.cancelled)
+    # The device takes three steps to write one, the ones in between aren't written late
+    self.assertGreater(ramp.skipped, 0)
+    self.assertLess(ramp.writes, 30)
+    self.assertEqual(self.register(device, headphones, 'level'), 60)
+    self.assertEqual(self.transport.written[-1], (51, 1, 60))
+    levels = [value for bRequest, wIndex, value in self.transport.written]
+    self.assertEqual(levels, sorted(levels))
+
+  def test_setting_the_value_cancels_the_ramp(self):
+    device = self.open()
+    headphones = device.outputs[1]
+    ramp = headphones.fade_to(-60, 10)
+    time.sleep(0.05)
+    headphones.level = -30
+    self.assertTrue(ramp.wait(1))
+    self.assertTrue(ramp.cancelled)
+    device.flush()
+    time.sleep(0.05)
+    self.assertEqual(headphones.level, -30)
+    self.assertEqual(self.register(device, headphones, 'level'), 30)
+
+class RecoveryTest(DeviceTestCase):
+  def test_written_values_are_restored_after_a_reset(self):
+    device = self.open()
+    device.outputs[1].level = -30
+    device.inputs[0].phantom_power_state = State.ENABLED
+    device.flush()
+    self.transport.unplug()
+    threading.Timer(0.1, self.transport.plug, kwargs={'reset': True}).start()
+    # Waits for the device to come back
+    self.assertEqual(device.get_output_level(device.outputs[0], fresh=True), -20)
+    self.assertTrue(device.connected)
+    self.assertEqual(self.register(device, device.outputs[1], 'level'), 30)
+    self.assertEqual(self.register(device, device.inputs[0], 'phantom_power_state'), State.ENABLED.value)
+
+  def test_write_while_unplugged_is_done_when_it_comes_back(self):
+    device = self.open()
+    self.transport.unplug()
+    threading.Timer(0.1, self.transport.plug).start()
+    device.set_output_level(device.outputs[1], -10).result()
+    self.assertEqual(self.register(device, device.outputs[1], 'level'), 10)
+
+class PollingTest(DeviceTestCase):
+  def test_changes_on_the_device_are_notified(self):
+    device = self.open()
+    changed = threading.Event()
+    changes = []
+    def on_change(change):
+      changes.append(change)
+      changed.set()
+    device.subscribe(on_change)
+    self.transport.registers[device.register_of(device.outputs[0], 'mute_state')] = State.ENABLED.value
+    device.start_polling(fast_interval=0.01, slow_interval=0.01)
+    self.assertTrue(changed.wait(2))
+    device.stop_polling()
+    self.assertEqual((changes[0].name, changes[0].new, changes[0].local), ('mute_state', State.ENABLED, False))
+    self.assertEqual(device.outputs[0].mute_state, State.ENABLED)
+
+class ManagerTest(unittest.TestCase):
+  def setUp(self):
+    self.transports = {id_: SimulatedDuet(id_=id_) for id_ in ('a', 'b')}
+    self.manager = DuetManager(self.transports)
+    self.addCleanup(self.manager.close)
+
+  def test_set_on_every_device(self):
+    self.manager.set('outputs.2.level', -30)
+    self.assertEqual([transport.registers[51, 1] for transport in self.transports.values()], [30, 30])
+    futures = self.manager.fan_out(lambda device, attribute: getattr(device.outputs[1], attribute), 'level')
+    self.assertEqual({id_: future.result() for id_, future in futures.items()}, {'a': -30, 'b': -30})
+    with self.assertRaises(ValueError):
+      self.manager.set('outputs.9.level', -30)
+
+  def test_call_raises_the_first_error_after_all_finished(self):
+    done = []
+    def fail(device, ids):
+      if device._transport.id in ids:
+        raise RuntimeError(device._transport.id)
+      time.sleep(0.05)
+      done.append(device._transport.id)
+      return device._transport.id
+    with self.assertRaisesRegex(RuntimeError, 'a'):
+      self.manager.call(fail, {'a'})
+    self.assertEqual(done, ['b'])
+    # The other errors are logged
+    with self.assertLogs('apogee_duet', 'ERROR') as logs:
+      with self.assertRaisesRegex(RuntimeError, 'a'):
+        self.manager.call(fail, {'a', 'b'})
+    self.assertEqual(len(logs.records), 1)
+    self.assertEqual(self.manager.call(fail, set()), {'a': 'a', 'b': 'b'})
+
+class AsyncTest(DeviceTestCase):
+  def test_set_and_gather(self):
+    device = self.open(max_write_rate=5)
+    duet = AsyncApogeeDuet(device)
+    async def main():
+      await duet.outputs[1].set('level', -35)
+      await duet.mixer_channels[0].set('pan', 10)
+      # Written when set() returns, not only queued
+      self.assertEqual(self.register(device, device.outputs[1], 'level'), 35)
+      self.assertEqual(await duet.outputs[1].get('level', fresh=True), -35)
+      self.transport.registers[device.register_of(device.outputs[0], 'level')] = 40
+      return await duet.gather((duet.outputs[0], 'level'), (device.mixer_channels[0], 'pan'), fresh=True)
+    self.assertEqual(asyncio.run(main()), [-40, 10])
+
+class InputTest(DeviceTestCase):
+  def test_line_inputs_have_no_level(self):
+    device = self.open()
+    input_ = device.inputs[0]
+    input_.type_ = InputType.LINE_4DBU
+    for attribute in ('level', 'min_level', 'max_level'):
+      with self.assertRaises(ValueError):
+        getattr(input_, attribute)
+    with self.assertRaises(ValueError):
+      device.register_of(input_, 'level')
+    self.assertEqual(device.index_of(input_, 'level'), 0)
+
+class CacheTest(DeviceTestCase):
+  def test_cached_state(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    cache = StateCache(directory.name)
+    transport = SimulatedDuet()
+    device = ApogeeDuet(transport=transport, cache=cache)
+    device.outputs[0].level = -35
+    device.close()
+    # Changed while it was closed
+    transport.registers[51, 1] = 40
+    device = self.open(transport, cache=cache, preload=False)
+    # The cached values first, and then the ones that changed
+    self.assertEqual(device.outputs[0].level, -35)
+    changed = device.verified.result()
+    self.assertEqual(changed, [(51, 1)])
+    self.assertEqual(device.outputs[1].level, -40)
+
+class LayoutTest(DeviceTestCase):
+  SMALL = Layout(1, (OutputType.SPEAKERS, OutputType.HEADPHONES),
+    (ChannelType.INPUT, ChannelType.SOFTWARE_RETURN, ChannelType.MASTER))
+
+  def probe(self, transport):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    store = CapabilityStore(directory.name)
+    capabilities = Capabilities()
+    self.assertTrue(Prober(transport, capabilities, range(256), range(8), rate=1e6).run())
+    store.save(transport.id, capabilities)
+    return store
+
+  def test_duet_layout_is_the_register_map(self):
+    self.assertEqual(_layout_registers(DUET_LAYOUT), _REGISTER_MAP)
+
+  def test_probed_layout(self):
+    store = self.probe(SimulatedDuet())
+    self.assertEqual(store.load('simulated').layout(), DUET_LAYOUT)
+
+  def test_device_with_another_layout(self):
+    store = self.probe(RecordingDuet(id_='small', layout=self.SMALL))
+    device = self.open(RecordingDuet(id_='small', layout=self.SMALL), capabilities=store)
+    self.assertEqual(device.layout, self.SMALL)
+    self.assertEqual([channel.type_ for channel in device.mixer_channels], list(self.SMALL.mixer))
+    device.refresh()
+    preset = device.save_preset('small')
+    device.inputs[0].toggle_group()
+    device.mixer_channels[1].source = SoftwareReturnSource.PLAYBACK_3_4
+    device.flush()
+    device.recall_preset(preset).result()
+    self.assertEqual(device.inputs[0].group_state, State.DISABLED)
+    self.assertEqual(device.get_software_return_source(device.mixer_channels[1], fresh=True), SoftwareReturnSource.PLAYBACK_1_2)
+    self.assertNotIn('inputs.2.level', device.parameters())
+
+  def test_cached_layout(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    cache = StateCache(directory.name)
+    transport = SimulatedDuet(layout=self.SMALL)
+    ApogeeDuet(transport=transport, layout=self.SMALL, cache=cache).close()
+    # Without the layout, it's the one of the cache
+    device = self.open(transport, cache=cache, preload=False)
+    self.assertEqual(device.layout, self.SMALL)
+    self.assertEqual(device.verified.result(), [])
+
+if __name__ == '__main__':
+  unittest.main()
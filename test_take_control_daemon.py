@@ -0,0 +1,115 @@
+# Tests of take_control_daemon with a simulated Apogee Duet, the server and its clients on a socket in a temporary directory
+
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+import take_control_daemon
+from apogee_duet import ApogeeDuet, SimulatedDuet
+from take_control_daemon import DaemonClient, DaemonError, DuetServer
+
+class DaemonTest(unittest.TestCase):
+  def setUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    self.path = os.path.join(directory.name, 'take_control.sock')
+    self.device = ApogeeDuet(transport=SimulatedDuet())
+    self.addCleanup(self.device.close)
+    self.server = DuetServer(self.path, self.device, presets=directory.name)
+    thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    thread.start()
+    def stop():
+      self.server.shutdown()
+      self.server.server_close()
+      thread.join()
+    self.addCleanup(stop)
+
+  def connect(self, **kwargs):
+    client = DaemonClient(self.path, **kwargs)
+    self.addCleanup(client.close)
+    return client
+
+  def test_set_and_get(self):
+    client = self.connect()
+    client.call('set', values=[['inputs.1.type', 'instrument'], ['inputs.1.level', 30], ['outputs.2.mute', 'on']])
+    self.assertEqual(client.call('get', paths=['inputs.1.type', 'inputs.1.level', 'outputs.2.mute']), ['instrument', 30, 'on'])
+    self.assertEqual(client.call('get', paths=['inputs.1.level'], fresh=True), [30])
+
+  def test_requests_are_answered_in_order(self):
+    client = self.connect()
+    futures = [client.request('set', values=[['outputs.1.level', level]]) for level in range(-40, -30)]
+    futures.append(client.request('get', paths=['outputs.1.level']))
+    self.assertEqual(futures[-1].result(), [-31])
+
+  def test_errors(self):
+    client = self.connect()
+    with self.assertRaises(DaemonError):
+      client.call('get', paths=['outputs.9.level'])
+    with self.assertRaises(DaemonError):
+      client.call('set', values=[['outputs.1.level', 10]])
+    with self.assertRaises(DaemonError):
+      client.call('nothing')
+    self.assertEqual(client.call('get', paths=['outputs.1.level']), [-20])
+
+  def test_dump_and_presets(self):
+    client = self.connect()
+    client.call('save', name='start')
+    client.call('set', values=[['mixer.1.pan', 20]])
+    self.assertEqual(client.call('dump')['mixer.1.pan'], 20)
+    client.call('recall', name='start')
+    self.assertEqual(client.call('dump', refresh=True)['mixer.1.pan'], 0)
+    self.assertEqual(client.call('presets'), ['start'])
+
+  def test_subscribers_get_the_changes_of_other_clients(self):
+    changes = []
+    changed = threading.Event()
+    def on_change(path, value):
+      changes.append((path, value))
+      changed.set()
+    self.connect(on_change=on_change).call('subscribe', paths=['outputs.2.level'])
+    self.connect().call('set', values=[['outputs.1.level', -30], ['outputs.2.level', -33]])
+    self.assertTrue(changed.wait(2))
+    self.assertEqual(changes, [('outputs.2.level', -33)])
+
+  def test_subscribers_follow_the_input_type(self):
+    changes = []
+    changed = threading.Event()
+    def on_change(path, value):
+      changes.append((path, value))
+      if path == 'inputs.1.level':
+        changed.set()
+    client = self.connect()
+    client.call('set', values=[['inputs.1.type', 'line_4dbu']])
+    # Everything, with an input without level
+    self.connect(on_change=on_change).call('subscribe')
+    client.call('set', values=[['inputs.1.type', 'instrument'], ['inputs.1.level', 30]])
+    self.assertTrue(changed.wait(2))
+    self.assertEqual(changes, [('inputs.1.type', 'instrument'), ('inputs.1.level', 30)])
+
+  def test_subscriber_not_reading_is_disconnected(self):
+    # Small, so it fills up quickly
+    self.addCleanup(setattr, take_control_daemon._Connection, 'queue_size', take_control_daemon._Connection.queue_size)
+    take_control_daemon._Connection.queue_size = 8
+    stuck = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.addCleanup(stuck.close)
+    stuck.connect(self.path)
+    stuck.sendall(json.dumps({'id': 1, 'method': 'subscribe'}).encode() + b'\n')
+    time.sleep(0.1)
+    client = self.connect()
+    start = time.monotonic()
+    # More than the socket buffers and the queue can hold, none of them waits for the stuck client
+    for i in range(3000):
+      client.call('set', values=[['outputs.2.level', -60 + i % 50]])
+    self.assertLess(time.monotonic() - start, 30)
+    self.assertEqual(self.device._subscribers, [])
+    # Closed by the daemon, after what was already sent
+    stuck.settimeout(5)
+    while stuck.recv(65536):
+      pass
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,144 @@
+# Tests of the OSC codec and of OscBridge with a simulated Apogee Duet over UDP on localhost
+
+import socket
+import struct
+import time
+import unittest
+
+from apogee_duet import ApogeeDuet, InputType, SimulatedDuet, State
+from take_control_osc import OscBridge, osc_message, parse_message, parse_packet
+
+class CodecTest(unittest.TestCase):
+  def test_message_round_trip(self):
+    data = osc_message('/duet/outputs/2/level', -20, 1.5, 'on', True, False, None)
+    self.assertEqual(len(data) % 4, 0)
+    self.assertEqual(parse_message(data), ('/duet/outputs/2/level', [-20, 1.5, 'on', True, False, None]))
+
+  def test_bundle(self):
+    messages = [osc_message('/duet/outputs/1/mute', 1), osc_message('/duet/mixer/1/pan', -10)]
+    data = b'#bundle\0' + struct.pack('>q', 1) + b''.join(struct.pack('>i', len(message)) + message for message in messages)
+    self.assertEqual(list(parse_packet(data)), [('/duet/outputs/1/mute', [1]), ('/duet/mixer/1/pan', [-10])])
+
+  def test_invalid_type_tag(self):
+    with self.assertRaises(ValueError):
+      parse_message(b'/duet/refresh\0\0\0,x\0\0')
+
+  def test_nested_bundles(self):
+    self.assertEqual(list(parse_packet(nested_bundle(osc_message('/duet/refresh'), 3000))), [('/duet/refresh', [])])
+    with self.assertRaises(ValueError):
+      list(parse_packet(b'#bundle\0' + struct.pack('>qi', 1, -8) + osc_message('/duet/refresh')))
+
+# message inside depth bundles, each one inside the next
+def nested_bundle(message, depth):
+  for i in range(depth):
+    message = b'#bundle\0' + struct.pack('>qi', 1, len(message)) + message
+  return message
+
+class BridgeTest(unittest.TestCase):
+  def setUp(self):
+    self.start(SimulatedDuet())
+
+  def start(self, transport):
+    self.transport = transport
+    self.device = ApogeeDuet(transport=self.transport)
+    self.addCleanup(self.device.close)
+    self.bridge = OscBridge(self.device, port=0, rate=100)
+    self.bridge.start()
+    self.addCleanup(self.bridge.stop)
+    self.sender = self.client()
+    self.listener = self.client()
+    # Known by the bridge from now on, so it gets the changes
+    self.send(self.listener, '/duet/refresh')
+    self.receive(self.listener)
+
+  def client(self):
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.bind(('127.0.0.1', 0))
+    client.settimeout(2)
+    self.addCleanup(client.close)
+    return client
+
+  def send(self, client, address, *args):
+    client.sendto(osc_message(address, *args), ('127.0.0.1', self.bridge.port))
+
+  # The messages received until nothing arrives for a while, by address
+  def receive(self, client, wait=0.2):
+    messages = {}
+    client.settimeout(wait)
+    try:
+      while True:
+        address, args = parse_message(client.recv(65536))
+        messages[address] = args
+    except socket.timeout:
+      pass
+    return messages
+
+  def wait_applied(self, count):
+    deadline = time.monotonic() + 2
+    while self.bridge.applied < count and time.monotonic() < deadline:
+      time.sleep(0.01)
+    self.device.flush()
+
+  def test_value_is_written_and_sent_to_the_other_clients(self):
+    self.send(self.sender, '/duet/outputs/2/level', -30.0)
+    self.send(self.sender, '/duet/outputs/1/mute', 'on')
+    self.wait_applied(2)
+    self.assertEqual(self.device.outputs[1].level, -30)
+    self.assertEqual(self.device.outputs[0].mute_state, State.ENABLED)
+    received = self.receive(self.listener)
+    self.assertEqual(received['/duet/outputs/2/level'], [-30])
+    self.assertEqual(received['/duet/outputs/1/mute'], [1])
+    # Not back to the one that sent them
+    self.assertEqual(self.receive(self.sender), {})
+
+  def test_only_the_last_value_of_a_fader_is_written(self):
+    for level in range(-60, -9):
+      self.send(self.sender, '/duet/outputs/2/level', float(level))
+    deadline = time.monotonic() + 2
+    while self.device.outputs[1].level != -10 and time.monotonic() < deadline:
+      time.sleep(0.01)
+    self.assertEqual(self.device.outputs[1].level, -10)
+    self.assertLess(self.bridge.applied, self.bridge.received)
+
+  def test_message_without_value_asks_for_it(self):
+    self.send(self.sender, '/duet/mixer/1/pan')
+    self.assertEqual(self.receive(self.sender), {'/duet/mixer/1/pan': [0]})
+
+  def test_changes_on_the_device_are_sent(self):
+    self.transport.registers[self.device.register_of(self.device.outputs[0], 'dim_state')] = 1
+    self.device.refresh()
+    self.assertEqual(self.receive(self.listener), {'/duet/outputs/1/dim': [1]})
+
+  def test_changes_after_a_type_change_are_sent(self):
+    # Starts with an input without level
+    self.start(SimulatedDuet({(22, 0): InputType.LINE_4DBU.value}))
+    self.transport.registers[22, 0] = InputType.INSTRUMENT.value
+    self.transport.registers[62, 0] = 30
+    self.device.refresh()
+    received = self.receive(self.listener)
+    self.assertEqual(received['/duet/inputs/1/type'], [InputType.INSTRUMENT.value])
+    self.assertEqual(received['/duet/inputs/1/level'], [30])
+
+  def test_nested_bundles_dont_stop_the_receiver(self):
+    self.sender.sendto(nested_bundle(osc_message('/duet/outputs/2/level', -30), 3000), ('127.0.0.1', self.bridge.port))
+    self.send(self.sender, '/duet/outputs/1/mute', 1)
+    self.wait_applied(2)
+    self.assertEqual(self.device.outputs[1].level, -30)
+    self.assertEqual(self.device.outputs[0].mute_state, State.ENABLED)
+
+  def test_invalid_values_dont_stop_the_writer(self):
+    for count, value in enumerate((float('inf'), float('nan'), 'loud'), 1):
+      self.send(self.sender, '/duet/outputs/2/level', value)
+      # Each one taken by the writer before the next, so they aren't replaced by the last one
+      deadline = time.monotonic() + 2
+      while (self.bridge.received < count or self.bridge._pending) and time.monotonic() < deadline:
+        time.sleep(0.01)
+      time.sleep(0.05)
+    self.send(self.sender, '/duet/outputs/2/level', -25)
+    deadline = time.monotonic() + 2
+    while self.device.outputs[1].level != -25 and time.monotonic() < deadline:
+      time.sleep(0.01)
+    self.assertEqual(self.device.outputs[1].level, -25)
+
+if __name__ == '__main__':
+  unittest.main()
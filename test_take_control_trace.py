@@ -0,0 +1,75 @@
+# Tests of the traces of TracingTransport and of take_control_trace, with a simulated Apogee Duet
+
+import os
+import tempfile
+import unittest
+
+from apogee_duet import TRACE_ERROR, ApogeeDuet, SimulatedDuet, TracingTransport, TransportError
+from take_control_trace import Trace, initial_registers, is_read, replay
+
+class TraceTest(unittest.TestCase):
+  def setUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    self.path = os.path.join(directory.name, 'session.trace')
+    # A session with a write and a failed read
+    self.transport = SimulatedDuet()
+    tracing = TracingTransport(self.transport, self.path)
+    device = ApogeeDuet(transport=tracing)
+    try:
+      device.outputs[1].level = -30
+      device.flush()
+      self.transport.fail_next()
+      with self.assertRaises(TransportError):
+        device.get_output_level(device.outputs[0], fresh=True)
+      self.records = tracing.records
+    finally:
+      device.close()
+
+  def open(self):
+    trace = Trace(self.path)
+    self.addCleanup(trace.close)
+    return trace
+
+  def test_round_trip(self):
+    trace = self.open()
+    self.assertEqual(len(trace), self.records)
+    records = list(trace)
+    self.assertEqual(records[-1], trace[-1])
+    self.assertEqual([record.time for record in records], sorted(record.time for record in records))
+    writes = [(record.bRequest, record.wIndex, record.value) for record in records if not is_read(record)]
+    self.assertEqual(writes, [(51, 1, 30)])
+    failed = [record for record in records if record.flags & TRACE_ERROR]
+    self.assertEqual([(record.bRequest, record.wIndex) for record in failed], [(51, 0)])
+    # What the device had before the write
+    self.assertEqual(initial_registers(trace)[51, 1], 20)
+
+  def test_record_cut_by_a_crash_is_left_out(self):
+    with open(self.path, 'ab') as f:
+      f.write(b'\0' * 5)
+    self.assertEqual(len(self.open()), self.records)
+
+  def test_not_a_trace(self):
+    with open(self.path, 'wb') as f:
+      f.write(b'something else')
+    with self.assertRaises(ValueError):
+      Trace(self.path)
+
+  def test_replay(self):
+    trace = self.open()
+    transport = SimulatedDuet(initial_registers(trace))
+    result = replay(trace, transport, speed=None)
+    self.assertEqual((result.transfers, result.writes, result.errors, result.mismatches), (len(trace), 1, 0, 0))
+    self.assertEqual(transport.registers[51, 1], 30)
+
+  def test_replay_counts_the_reads_with_other_values(self):
+    trace = self.open()
+    reads = sum(1 for record in trace if is_read(record) and (record.bRequest, record.wIndex) == (51, 0) and not record.flags & TRACE_ERROR)
+    registers = initial_registers(trace)
+    registers[51, 0] = 40
+    result = replay(trace, SimulatedDuet(registers), speed=None)
+    self.assertGreater(reads, 0)
+    self.assertEqual(result.mismatches, reads)
+
+if __name__ == '__main__':
+  unittest.main()